@@ -1,13 +1,16 @@
 #! /usr/bin/python3
 
+import io
 import os
 import numpy as np
 from PIL import Image
 
 import customtkinter as ctk
 from tkinter import filedialog
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 
-from onas.gui import BG_COLOR, FG_COLOR, HIGHLIGHT_COLOR
+from onas.gui import BG_COLOR, FG_COLOR, HIGHLIGHT_COLOR, BackgroundWorker
 from onas.utils import execute_all_metrics
 from onas.codecs import JPEG
 
@@ -36,7 +39,10 @@ class App(ctk.CTk):
         self.result_images_size = (341, 213)
         self.options_frame = None
         self.results_frame = None
+        self.status_label = None
         self.steps_frame = None
+        self.steps = []
+        self.worker = BackgroundWorker()
 
         self.__init_navbar()
         self.__init_settings_tab()
@@ -45,6 +51,7 @@ class App(ctk.CTk):
 
         self.tabview.set("settings")
         self.on_codification_select("JPEG")
+        self.poll_worker()
 
     def __init_navbar(self):
         self.tabview = ctk.CTkTabview(self, fg_color=FG_COLOR, bg_color =FG_COLOR)
@@ -104,17 +111,27 @@ class App(ctk.CTk):
         self.tabview.tab("results").grid_rowconfigure(0, weight=1)
         self.tabview.tab("results").grid_rowconfigure(1, weight=9)
         self.tabview.tab("results").grid_rowconfigure(2, weight=1)
+        self.tabview.tab("results").grid_rowconfigure(3, weight=1)
+        self.tabview.tab("results").grid_rowconfigure(4, weight=1)
 
         ctk.CTkLabel(self.tabview.tab("results"), text="Results").grid(row=0, column=0, sticky=ctk.W + ctk.E)
         self.results_frame = ctk.CTkScrollableFrame(self.tabview.tab("results"), fg_color=FG_COLOR)
         self.results_frame.grid(row=1, column=0, sticky=ctk.N + ctk.E + ctk.S + ctk.W)
         self.results_frame.grid_columnconfigure(0, weight=1, uniform="a")
+        self.status_label = ctk.CTkLabel(self.tabview.tab("results"), text="")
+        self.status_label.grid(row=2, column=0, sticky=ctk.W + ctk.E)
+        ctk.CTkButton(
+            self.tabview.tab("results"),
+            text="cancel",
+            command=self.on_cancel,
+            fg_color=BG_COLOR
+        ).grid(row=3, column=0, sticky=ctk.W + ctk.E)
         ctk.CTkButton(
             self.tabview.tab("results"),
             text="save image",
             command=self.on_save_image,
             fg_color=HIGHLIGHT_COLOR
-        ).grid(row=2, column=0, sticky=ctk.W + ctk.E)
+        ).grid(row=4, column=0, sticky=ctk.W + ctk.E)
 
     def __init_main_frame(self):
         self.main_frame = ctk.CTkFrame(self, fg_color=BG_COLOR)
@@ -171,11 +188,18 @@ class App(ctk.CTk):
             ]
         )
         if file_path:
-            try:
-                self.codification(self.image_path, file_path)
-            except Exception as e:
-                # Dialog to print error
-                return
+            codification, image = self.codification, np.array(self.image)
+            self.worker.submit(
+                lambda progress: self.codify(codification, progress, image, file_path),
+                on_done=lambda _: self.show_status("Image saved"),
+                on_progress=self.show_progress,
+                on_error=self.show_error,
+                supersede=False
+            )
+
+    def on_cancel(self):
+        self.worker.cancel()
+        self.show_status("Cancelled")
 
     def on_codification_select(self, codification):
         if codification == "JPEG":
@@ -195,17 +219,93 @@ class App(ctk.CTk):
             )
         )
 
-        self.codification.configure(**self.tkvar_to_dict(self.codification_options))
-        self.place_steps(self.codification.steps(self.steps_frame))
-        coded_image = self.codification(self.image_path)
+        # The job only uses these values, so the settings can change while it runs
+        codification = self.codification
+        options = self.tkvar_to_dict(self.codification_options)
+        image = np.array(self.image)
+        self.steps = codification.steps(self.steps_frame)
+        self.place_steps(self.steps)
+
+        def job(progress):
+            # The GUI codes the same image again on every run, so it caches its coefficients
+            codification.configure(**options, profile=True, cache_budget=256)
+            coded_image = self.codify(codification, progress, image)
+            profiles = {"reconstruction": codification.stats}
+            encoded_size = self.encoded_size(codification, progress, image)
+            if encoded_size is not None:
+                profiles["encoding"] = codification.stats
+            metrics = execute_all_metrics(image, coded_image, encoded_size)
+            if getattr(codification, "side_information", None) and codification.side_information():
+                metrics["Side information (bytes)"] = codification.side_information()
+            progress("metrics")
+            return coded_image, metrics, codification.quantization_factor, profiles
+
+        def on_done(result):
+            self.show_results(result)
+            if hasattr(codification, "rd_sweep"):
+                self.run_rd_sweep(codification, image, result[2])
+
+        # A new run supersedes the running one
+        self.worker.submit(job, on_done=on_done, on_progress=self.show_progress, on_error=self.show_error)
+        self.show_status("Running")
+
+    def run_rd_sweep(self, codification, image, quantization_factor):
+        """
+        Evaluate the rate-distortion curve once the results are shown, in a
+        job of its own that a new run supersedes. The sweep notifies each
+        batch, so it is cancelled between batches.
+        """
+        def on_done(curve):
+            self.plot_rd_curve(curve, quantization_factor)
+            self.show_status("Done")
+
+        self.worker.submit(
+            lambda progress: self.codify(codification, progress, image, method="rd_sweep"),
+            on_done=on_done,
+            on_progress=self.show_progress,
+            on_error=self.show_error
+        )
+
+    def codify(self, codification, progress, *args, method="__call__"):
+        """
+        Call the codification (or one of its methods) in the background
+        worker, reporting the progress of its stages
+        """
+        codification.add_listener(progress)
+        try:
+            return getattr(codification, method)(*args)
+        finally:
+            codification.remove_listener(progress)
+
+    def poll_worker(self):
+        self.worker.poll()
+        self.after(50, self.poll_worker)
+
+    def show_status(self, text):
+        self.status_label.configure(text=text)
 
+    def show_progress(self, stage):
+        self.show_status(f"Running: {stage}")
+        for step in self.steps:
+            step.draw_pending()
+
+    def show_error(self, error):
+        self.show_status(f"Error: {error}")
+
+    def show_results(self, result):
+        coded_image, metrics, _, profiles = result
         self.codified_image.configure(
             image=ctk.CTkImage(
                 Image.fromarray(coded_image),
                 size=(self.result_images_size[0], coded_image.shape[0] * self.result_images_size[0] // coded_image.shape[1])
             )
         )
-        self.fill_results(coded_image)
+        self.fill_results(metrics)
+        for name, stats in profiles.items():
+            self.fill_profile(name, stats)
+        for step in self.steps:
+            step.draw_pending()
+        self.show_status("Done")
 
     def fill_codification_options(self, options: dict):
         # Clean previous options
@@ -280,21 +380,87 @@ class App(ctk.CTk):
         for widget in self.results_frame.winfo_children():
             widget.destroy()
 
-    def fill_results(self, coded):
-        metrics = execute_all_metrics(np.array(self.image), coded)
+    def encoded_size(self, codification, progress, image):
+        """
+        Encode the image in memory to measure its size
+
+        Returns:
+            The size in bytes of the encoded image, None if the codification cannot save it
+        """
+        try:
+            return self.codify(codification, progress, image, io.BytesIO())
+        except ValueError:
+            return None
+
+    def fill_results(self, metrics):
         for key, value in metrics.items():
-            result_frame = ctk.CTkFrame(
-                self.results_frame,
-                fg_color=FG_COLOR,
-                corner_radius=5
-            )
-            result_frame.grid(row=len(self.results_frame.winfo_children()), column=0, sticky=ctk.W + ctk.E, pady=5, padx=5)
-            result_frame.grid_columnconfigure(0, weight=1, uniform="a")
-            result_frame.grid_columnconfigure(1, weight=1, uniform="a")
-            result_frame.grid_rowconfigure(0, weight=1, uniform="a")
-            ctk.CTkLabel(result_frame, text=key, fg_color=FG_COLOR).grid(row=0, column=0, sticky=ctk.W + ctk.E)
-            ctk.CTkLabel(result_frame, text=str(value), fg_color=FG_COLOR).grid(row=0, column=1, sticky=ctk.W + ctk.E)
-        
+            if isinstance(value, np.ndarray):
+                self.plot_result_map(key, value)
+            else:
+                self.add_result(key, str(value))
+
+    def fill_profile(self, name, stats):
+        """
+        Show the time spent in each stage of a call of the codification
+        """
+        ctk.CTkLabel(self.results_frame, text=f"Profile: {name}").grid(
+            row=len(self.results_frame.winfo_children()), column=0, sticky=ctk.W + ctk.E, pady=5, padx=5
+        )
+        for stage, stage_stats in stats.stages.items():
+            self.add_result(stage, f"{stage_stats['time'] * 1000:.2f} ms")
+        self.add_result("total", f"{stats.total_time * 1000:.2f} ms")
+
+    def add_result(self, key, text):
+        result_frame = ctk.CTkFrame(
+            self.results_frame,
+            fg_color=FG_COLOR,
+            corner_radius=5
+        )
+        result_frame.grid(row=len(self.results_frame.winfo_children()), column=0, sticky=ctk.W + ctk.E, pady=5, padx=5)
+        result_frame.grid_columnconfigure(0, weight=1, uniform="a")
+        result_frame.grid_columnconfigure(1, weight=1, uniform="a")
+        result_frame.grid_rowconfigure(0, weight=1, uniform="a")
+        ctk.CTkLabel(result_frame, text=key, fg_color=FG_COLOR).grid(row=0, column=0, sticky=ctk.W + ctk.E)
+        ctk.CTkLabel(result_frame, text=text, fg_color=FG_COLOR).grid(row=0, column=1, sticky=ctk.W + ctk.E)
+
+
+    def plot_result_map(self, name, values):
+        """
+        Plot a metric map, like the PSNR of each block, in the results tab
+        """
+        fig = Figure()
+        fig.set_size_inches(3, 2.5)
+        plot = fig.add_subplot(111)
+        colors = plot.imshow(np.minimum(values, np.max(values[np.isfinite(values)], initial=0)), cmap="viridis")
+        fig.colorbar(colors)
+        plot.set_title(name)
+        plot.axis("off")
+        fig.tight_layout()
+
+        canvas = FigureCanvasTkAgg(fig, master=self.results_frame)
+        canvas.get_tk_widget().grid(row=len(self.results_frame.winfo_children()), column=0, sticky=ctk.W + ctk.E, pady=5, padx=5)
+        canvas.draw()
+
+    def plot_rd_curve(self, curve, quantization_factor):
+        """
+        Plot the rate-distortion curve of the image in the results tab,
+        marking the quantization factor used
+        """
+        current = np.argmin(np.abs(curve["factors"] - quantization_factor))
+
+        fig = Figure()
+        fig.set_size_inches(3, 2.5)
+        plot = fig.add_subplot(111)
+        plot.plot(curve["bpp"], curve["psnr"])
+        plot.plot(curve["bpp"][current], curve["psnr"][current], "o")
+        plot.set_xlabel("bits per pixel")
+        plot.set_ylabel("PSNR (dB)")
+        fig.tight_layout()
+
+        canvas = FigureCanvasTkAgg(fig, master=self.results_frame)
+        canvas.get_tk_widget().grid(row=len(self.results_frame.winfo_children()), column=0, sticky=ctk.W + ctk.E, pady=5, padx=5)
+        canvas.draw()
+
     def tkvar_to_dict(self, variables) -> dict:
         """
         Convert a dictionary of tkinter variables to a dictionary of python values
@@ -0,0 +1,283 @@
+#! /usr/bin/python3
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+
+import numpy as np
+from docopt import docopt
+from onas import JPEG
+from onas.codecs.validation import (
+    ACCURACY_IMPLEMENTATIONS, IMPORT_BUDGET, PRECISION_MEGAPIXELS, accuracy_failures, import_check,
+    precision_accuracy, precision_failures, transform_accuracy
+)
+from onas.utils import synthetic_image
+
+# Times compared against the baseline
+COMPARED_METRICS = ("encode_time", "decode_time")
+
+
+def peak_rss():
+    """
+    Get the peak resident set size of the process in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(case):
+    """
+    Benchmark a case in the current process. The image is compressed to a
+    file and decoded (8x8 blocks, the only ones that can be saved) or
+    reconstructed in memory (other block sizes), keeping the stage times of
+    the fastest run. An untimed run goes first, so the lazy imports and the
+    first allocations don't count in the times.
+
+    Args:
+        case: A dictionary with the kind, megapixels, block_size, factor and repeat of the case
+    Returns:
+        The case with its results
+    """
+    image = synthetic_image(case["kind"], case["megapixels"])
+    jpeg = JPEG()
+    jpeg.configure(**{
+        "Quantization Factor": case["factor"],
+        "Block Size": str(case["block_size"]),
+        "DCT Implementation": case.get("implementation", "SciPy"),
+        "Transform": case.get("transform", "DCT"),
+        "Precision": case.get("precision", "Double"),
+        "profile": True,
+        "cache_budget": 0,
+    })
+    result = dict(case, shape=image.shape)
+    megabytes = image.nbytes / 1e6
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "image.jpg")
+        encode = (lambda: jpeg(image, path)) if jpeg.is_standard() else (lambda: jpeg(image))
+        encode()
+        if jpeg.is_standard():
+            jpeg.decode(path)
+        best = None
+        for _ in range(case["repeat"]):
+            encode()
+            if best is None or jpeg.stats.total_time < best.total_time:
+                best = jpeg.stats
+        result["encode_time"] = best.total_time
+        result["encode_mbps"] = megabytes / best.total_time
+        result["encode_stages"] = {stage: stats["time"] for stage, stats in best.stages.items()}
+
+        if jpeg.is_standard():
+            result["compressed_size"] = os.path.getsize(path)
+            best = None
+            for _ in range(case["repeat"]):
+                jpeg.decode(path)
+                if best is None or jpeg.stats.total_time < best.total_time:
+                    best = jpeg.stats
+            result["decode_time"] = best.total_time
+            result["decode_mbps"] = megabytes / best.total_time
+            result["decode_stages"] = {stage: stats["time"] for stage, stats in best.stages.items()}
+
+    result["coding_gain"] = coding_gain(jpeg._coefficients(image))
+    result["side_information"] = jpeg.side_information()
+    result["peak_rss"] = peak_rss()
+    return result
+
+
+def coding_gain(coefficients):
+    """
+    Measure the energy compaction of a transform as its coding gain: the
+    ratio in dB of the arithmetic and geometric means of the variances of
+    the coefficients over the blocks
+
+    Args:
+        coefficients: The (rows, cols, block_size, block_size) transformed blocks
+    Returns:
+        The coding gain in dB
+    """
+    variances = coefficients.reshape(-1, coefficients.shape[-1] ** 2).var(axis=0)
+    # Coefficients that never change would make the gain infinite
+    variances = np.maximum(variances, 1e-12)
+    return float(10 * np.log10(variances.mean() / np.exp(np.log(variances).mean())))
+
+
+def format_precision(result):
+    double, single = result["Double"], result["Single"]
+    return (
+        f"{result['kind']:<9}{result['megapixels']:>7g} MP  {result['block_size']:>3}x{result['block_size']:<3} "
+        f"PSNR {double['psnr']:6.2f} -> {single['psnr']:6.2f} dB  "
+        f"peak {double['peak_memory'] / 2 ** 20:7.1f} -> {single['peak_memory'] / 2 ** 20:7.1f} MB  "
+        f"changed {result['changed_pixels'] * 100:6.2f}%"
+    )
+
+
+def format_accuracy(result):
+    return (
+        f"{result['kind']:<9}{result['megapixels']:>7g} MP  {result['block_size']:>3}x{result['block_size']:<3} "
+        f"{result['implementation']:<10}coefficients max {result['max_error']:.2e} RMS {result['rms_error']:.2e}  "
+        f"pixels max {result['max_pixel_error']:g} changed {result['changed_pixels'] * 100:6.2f}%  "
+        f"{result['time'] * 1000:8.1f} ms"
+    )
+
+
+def case_key(case):
+    return (
+        case["kind"], case["megapixels"], case["block_size"], case["factor"],
+        case.get("implementation", "SciPy"), case.get("transform", "DCT"), case.get("precision", "Double")
+    )
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the times of the results with the ones of the baseline
+
+    Args:
+        results: The results of the benchmark
+        baseline: The results of a previous run
+        threshold: The maximum slowdown allowed, in percent
+    Returns:
+        A list of (case, metric, baseline value, value) of the regressions
+    """
+    baseline_cases = {case_key(case): case for case in baseline["results"]}
+    regressions = []
+    for case in results:
+        baseline_case = baseline_cases.get(case_key(case))
+        if baseline_case is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric in case and metric in baseline_case:
+                if case[metric] > baseline_case[metric] * (1 + threshold / 100):
+                    regressions.append((case, metric, baseline_case[metric], case[metric]))
+    return regressions
+
+
+def format_case(case):
+    line = (
+        f"{case['kind']:<9}{case['megapixels']:>7g} MP  {case['block_size']:>3}x{case['block_size']:<3} k={case['factor']:<4g}"
+        f"{case.get('transform', 'DCT'):<4}{case.get('implementation', 'SciPy'):<8}{case.get('precision', 'Double'):<7}gain {case['coding_gain']:5.2f} dB  "
+        f"encode {case['encode_time'] * 1000:9.1f} ms {case['encode_mbps']:7.1f} MB/s"
+    )
+    if "decode_time" in case:
+        line += f"  decode {case['decode_time'] * 1000:9.1f} ms {case['decode_mbps']:7.1f} MB/s"
+    return line + f"  peak RSS {case['peak_rss'] / 2 ** 20:8.1f} MB"
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+if __name__ == "__main__":
+    usage = f"""
+    Benchmark the JPEG codec with synthetic images.
+
+    Every case runs in a fresh process, so its peak RSS is its own.
+
+    Usage:
+        {sys.argv[0]} [options]
+        {sys.argv[0]} (-h | --help)
+
+    Options:
+        -h --help                 Show this screen.
+        --kinds=<kinds>           Comma separated image kinds: noise, gradient, text [default: noise,gradient,text].
+        --sizes=<mp>              Comma separated image sizes in megapixels, up to 100 [default: 0.25,1,4].
+        --block-sizes=<sizes>     Comma separated block sizes [default: 8,16,32,64,128].
+        --factors=<factors>       Comma separated quantization factors [default: 1,10,50].
+        --transforms=<names>      Comma separated transforms: DCT, KLT, FFT [default: DCT].
+        --implementations=<names>  Comma separated DCT implementations: SciPy, Matrix, Integer [default: SciPy].
+        --precisions=<names>      Comma separated precisions: Double, Single [default: Double].
+        --repeat=<n>              Runs of each case, the fastest one is kept [default: 3].
+        --output=<path>           Write the results to a JSON file.
+        --baseline=<path>         Compare the times with the results of a previous run.
+        --threshold=<percent>     Slowdown over the baseline that fails the benchmark [default: 10].
+        --import-budget=<ms>      Import time of the codec that fails the benchmark [default: {IMPORT_BUDGET}].
+        --accuracy                Report the accuracy of the DCT implementations against SciPy
+                                  and of the single precision against the double one, for the
+                                  kinds and block sizes, on 0.25 MP images (1 MP for the precision).
+                                  An implementation fails the benchmark if its errors exceed its
+                                  tolerances, the single precision if it changes the PSNR or
+                                  doesn't halve the peak memory.
+    """
+    args = docopt(usage, help=True)
+
+    cases = [
+        {
+            "kind": kind, "megapixels": float(megapixels), "block_size": int(block_size), "factor": float(factor),
+            "transform": transform, "implementation": implementation, "precision": precision,
+            "repeat": int(args["--repeat"])
+        }
+        for kind in args["--kinds"].split(",")
+        for megapixels in args["--sizes"].split(",")
+        for block_size in args["--block-sizes"].split(",")
+        for factor in args["--factors"].split(",")
+        for transform in args["--transforms"].split(",")
+        for implementation in args["--implementations"].split(",")
+        # The implementation only changes the DCT
+        if transform == "DCT" or implementation == args["--implementations"].split(",")[0]
+        for precision in args["--precisions"].split(",")
+    ]
+
+    failed = False
+    import_time, lazy_modules = import_check()
+    print(f"Import of onas: {import_time * 1000:.1f} ms", flush=True)
+    if import_time * 1000 > float(args["--import-budget"]):
+        print(f"IMPORT BUDGET exceeded: {import_time * 1000:.1f} ms > {args['--import-budget']} ms")
+        failed = True
+    if lazy_modules:
+        print(f"IMPORT of onas loads lazy modules: {', '.join(lazy_modules)}")
+        failed = True
+
+    accuracy = []
+    if args["--accuracy"]:
+        for kind in args["--kinds"].split(","):
+            for block_size in args["--block-sizes"].split(","):
+                for implementation in ACCURACY_IMPLEMENTATIONS:
+                    result = transform_accuracy(kind, 0.25, int(block_size), implementation)
+                    print(format_accuracy(result), flush=True)
+                    accuracy.append(result)
+                    for failure in accuracy_failures(result):
+                        print(f"ACCURACY {kind} {block_size}x{block_size} {implementation}: {failure}")
+                        failed = True
+                result = precision_accuracy(kind, PRECISION_MEGAPIXELS, int(block_size))
+                print(format_precision(result), flush=True)
+                accuracy.append(result)
+                for failure in precision_failures(result):
+                    print(f"PRECISION {kind} {block_size}x{block_size}: {failure}")
+                    failed = True
+
+    results = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases):
+            print(format_case(result), flush=True)
+            results.append(result)
+
+    if args["--output"]:
+        with open(args["--output"], "w") as f:
+            json.dump({"environment": environment(), "import_time": import_time, "accuracy": accuracy, "results": results}, f, indent=4)
+
+    if args["--baseline"]:
+        with open(args["--baseline"]) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, float(args["--threshold"]))
+        for case, metric, baseline_value, value in regressions:
+            print(
+                f"REGRESSION {case['kind']} {case['megapixels']:g} MP {case['block_size']}x{case['block_size']} k={case['factor']:g} "
+                f"{case.get('transform', 'DCT')} {case.get('implementation', 'SciPy')} {case.get('precision', 'Double')}: "
+                f"{metric} {baseline_value * 1000:.1f} -> {value * 1000:.1f} ms ({(value / baseline_value - 1) * 100:+.1f}%)"
+            )
+        if regressions:
+            failed = True
+        else:
+            print(f"No regressions over {args['--threshold']}% against {args['--baseline']}")
+
+    if failed:
+        sys.exit(1)
@@ -1,9 +1,108 @@
 #! /usr/bin/python3
 
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
 from onas import JPEG
+from onas.utils import execute_all_metrics
 from docopt import docopt
-import matplotlib.pyplot as plt
+from PIL import Image
+
+# JPEG instance of each batch worker process, configured once
+worker_jpeg = None
+worker_metrics = False
+
+
+def init_batch_worker(configuration, metrics=False):
+    global worker_jpeg, worker_metrics
+    worker_jpeg = JPEG()
+    worker_jpeg.configure(**configuration)
+    worker_metrics = metrics
+
+
+def file_metrics(image, output_path):
+    """
+    Calculate the quality metrics of a compressed file, decoding it
+    """
+    return execute_all_metrics(image, JPEG().decode(output_path), os.path.getsize(output_path))
+
+
+def format_metrics(metrics):
+    """
+    Format the metrics in a line, summarizing the maps by their worst value
+    """
+    return ", ".join(
+        f"{key}: min {np.min(value):.2f}" if isinstance(value, np.ndarray) else f"{key}: {value}"
+        for key, value in metrics.items()
+    )
+
+
+def compress_file(input_path, output_path):
+    """
+    Compress a file in a batch worker
+
+    Returns:
+        The input path, the number of pixels, the input and output sizes in
+        bytes, the time spent and the quality metrics if enabled
+    """
+    start = time.perf_counter()
+    image = np.array(Image.open(input_path).convert('L'))
+    worker_jpeg(image, output_path)
+    elapsed = time.perf_counter() - start
+    metrics = file_metrics(image, output_path) if worker_metrics else None
+    return input_path, image.size, os.path.getsize(input_path), os.path.getsize(output_path), elapsed, metrics
+
+
+def batch(input_dir, output_dir, patterns, configuration, jobs, metrics=False):
+    """
+    Compress all the files of a directory and its subdirectories that match
+    the glob patterns with a pool of worker processes, printing each result
+    as soon as it is ready and a summary with the throughput at the end. The
+    output keeps the layout of the subdirectories and the name of each file
+    with .jpg appended, so a.png and a.jpg don't overwrite each other.
+    """
+    input_dir, output_dir = Path(input_dir), Path(output_dir)
+    files = sorted({path for pattern in patterns for path in input_dir.rglob(pattern) if path.is_file()})
+    tasks = []
+    for path in files:
+        output_path = output_dir / path.relative_to(input_dir)
+        output_path = output_path.with_name(output_path.name + ".jpg")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        tasks.append((str(path), str(output_path)))
+
+    # Each file is encoded by a single worker, the pool already uses all the jobs
+    configuration = dict(configuration, workers=1)
+    latencies, pixels, bytes_in, bytes_out = [], 0, 0, 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker, initargs=(configuration, metrics)) as pool:
+        futures = {pool.submit(compress_file, *task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                path, n_pixels, size_in, size_out, elapsed, image_metrics = future.result()
+            except Exception as e:
+                print(f"{futures[future]}: error: {e}", file=sys.stderr)
+                continue
+            latencies.append(elapsed)
+            pixels += n_pixels
+            bytes_in += size_in
+            bytes_out += size_out
+            print(f"{path}: {size_in} -> {size_out} bytes ({elapsed * 1000:.1f} ms)", flush=True)
+            if image_metrics:
+                print(f"    {format_metrics(image_metrics)}", flush=True)
+    wall_time = time.perf_counter() - start
+
+    if not latencies:
+        print("No images compressed")
+        return
+    print(f"Images:            {len(latencies)} in {wall_time:.2f} s ({len(latencies) / wall_time:.2f} images/s)")
+    print(f"Throughput:        {bytes_in / wall_time / 1e6:.2f} MB/s in, {bytes_out / wall_time / 1e6:.2f} MB/s out")
+    print(f"Compression ratio: {pixels / bytes_out:.2f} (8-bit pixels / output bytes)")
+    print(f"Latency:           p50 {np.percentile(latencies, 50) * 1000:.1f} ms, p99 {np.percentile(latencies, 99) * 1000:.1f} ms")
+
 
 if __name__ == "__main__":
     usage = f"""
@@ -12,6 +111,8 @@ if __name__ == "__main__":
     Usage:
         {sys.argv[0]} show [options] <input>
         {sys.argv[0]} compress [options] <input> <output>
+        {sys.argv[0]} decompress [options] <input> <output>
+        {sys.argv[0]} batch [options] <input_dir> <output_dir>
         {sys.argv[0]} (-h | --help)
         {sys.argv[0]} --version
     
@@ -19,19 +120,66 @@ if __name__ == "__main__":
         -h --help             Show this screen.
         --version             Show version.
         -k <k>, --factor=<k>  Compression factor [default: 1].
+        --target-bytes=<n>    Search the compression factor to fit the file in n bytes, instead of --factor.
+        --target-psnr=<db>    Search the compression factor to reach a PSNR in dB, instead of --factor.
+        --optimize            Build Huffman tables optimized for the image.
+        --single              Transform in single precision and keep the quantized coefficients as int16.
+        -j <n>, --jobs=<n>    Worker processes: restart intervals of an image, or files in batch mode [default: 1].
+        --stream              Compress the image by strips, for images bigger than the memory.
+        --strip-rows=<n>      Rows of blocks of each strip when streaming [default: 64].
+        --shape=<HxW>         Shape of a raw 8-bit input file, e.g. 20000x30000.
+        --metrics             Print the quality metrics of the compressed images.
+        --profile             Print the time spent in each stage.
+        --profile-json=<path> Write the time spent in each stage to a JSON file.
+        --profile-memory      Also measure the memory peak of each stage (slower).
+        --glob=<patterns>     Comma separated file patterns of the batch mode, searched in the subdirectories too
+                              [default: *.png,*.jpg,*.jpeg,*.bmp].
     """
     args = docopt(usage, help=True, version="0.1")
 
     configuration = {
         "Quantization Factor": float(args["--factor"]),
+        "Optimize Huffman": args["--optimize"],
+        "Precision": "Single" if args["--single"] else "Double",
+        "workers": int(args["--jobs"]),
+        "target_bytes": args["--target-bytes"],
+        "target_psnr": args["--target-psnr"],
+        "profile": "memory" if args["--profile-memory"] else bool(args["--profile"] or args["--profile-json"]),
     }
     jpeg = JPEG()
     jpeg.configure(**configuration)
 
     if args["show"]:
         image = jpeg(args["<input>"])
+        import matplotlib.pyplot as plt
         plt.imshow(image, cmap="gray")
         plt.axis("off")
         plt.show()
+    elif args["compress"] and (args["--stream"] or args["--shape"]):
+        shape = tuple(int(x) for x in args["--shape"].split("x")) if args["--shape"] else None
+        jpeg.encode_stream(args["<input>"], args["<output>"], int(args["--strip-rows"]), shape)
     elif args["compress"]:
         jpeg(args["<input>"], args["<output>"])
+        if jpeg.target_bytes or jpeg.target_psnr:
+            print(f"Compression factor: {jpeg.quantization_factor}")
+        if args["--metrics"]:
+            image = np.array(Image.open(args["<input>"]).convert('L'))
+            print(format_metrics(file_metrics(image, args["<output>"])))
+    elif args["decompress"]:
+        Image.fromarray(jpeg.decode(args["<input>"])).save(args["<output>"])
+    elif args["batch"]:
+        batch(
+            args["<input_dir>"],
+            args["<output_dir>"],
+            args["--glob"].split(","),
+            configuration,
+            int(args["--jobs"]),
+            args["--metrics"]
+        )
+
+    if jpeg.stats and not args["batch"]:
+        if args["--profile-json"]:
+            with open(args["--profile-json"], "w") as f:
+                f.write(jpeg.stats.to_json(indent=4))
+        else:
+            print(jpeg.stats)
@@ -1,3 +1,11 @@
 from .utils import *
 from .codecs import *
 from .gui import *
+
+
+def __getattr__(name):
+    # The GUI classes that need customtkinter and matplotlib are imported on first use
+    if name == "StepsFrame":
+        from .gui import StepsFrame
+        return StepsFrame
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
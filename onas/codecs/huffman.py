@@ -0,0 +1,358 @@
+import heapq
+from array import array
+import numpy as np
+
+# Number of bits of the first level decoding lookup table
+LOOKUP_BITS = 9
+
+# Standard luminance Huffman tables (ITU-T T.81, Annex K.3). Each table is
+# described by the number of codes of each length (1 to 16 bits) and the
+# symbols sorted by code length.
+STANDARD_DC_BITS = (0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0)
+STANDARD_DC_VALUES = tuple(range(12))
+
+STANDARD_AC_BITS = (0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7d)
+STANDARD_AC_VALUES = (
+    0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+    0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xa1, 0x08, 0x23, 0x42, 0xb1, 0xc1, 0x15, 0x52, 0xd1, 0xf0,
+    0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0a, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x25, 0x26, 0x27, 0x28,
+    0x29, 0x2a, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+    0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+    0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+    0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5, 0xa6, 0xa7,
+    0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5,
+    0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda, 0xe1, 0xe2,
+    0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf1, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa
+)
+
+
+class HuffmanTable:
+    def __init__(self, bits, values):
+        """
+        Build the code table of a canonical Huffman table
+
+        Args:
+            bits: The number of codes of each length, from 1 to 16 bits
+            values: The symbols sorted by code length
+        """
+        self.bits = tuple(bits)
+        self.values = tuple(values)
+        self.codes = np.zeros(256, dtype=np.uint64)
+        self.lengths = np.zeros(256, dtype=np.uint64)
+
+        # Decoding tables: a lookup table indexed by the next LOOKUP_BITS bits
+        # for the short codes and the biggest code of each length for the rest
+        self.lookup_symbols = [0] * (1 << LOOKUP_BITS)
+        self.lookup_lengths = [0] * (1 << LOOKUP_BITS)
+        self.max_codes = [-1] * 17
+        self.value_offsets = [0] * 17
+
+        code = 0
+        k = 0
+        for length, count in enumerate(self.bits, start=1):
+            self.value_offsets[length] = k - code
+            for _ in range(count):
+                self.codes[self.values[k]] = code
+                self.lengths[self.values[k]] = length
+                if length <= LOOKUP_BITS:
+                    first = code << (LOOKUP_BITS - length)
+                    for index in range(first, first + (1 << (LOOKUP_BITS - length))):
+                        self.lookup_symbols[index] = self.values[k]
+                        self.lookup_lengths[index] = length
+                code += 1
+                k += 1
+            self.max_codes[length] = code - 1
+            code <<= 1
+
+    @classmethod
+    def standard_dc(cls):
+        return cls(STANDARD_DC_BITS, STANDARD_DC_VALUES)
+
+    @classmethod
+    def standard_ac(cls):
+        return cls(STANDARD_AC_BITS, STANDARD_AC_VALUES)
+
+
+def amplitude_bits(amplitudes, sizes):
+    """
+    Get the bits that represent the amplitudes in the JPEG format: positive
+    values are stored as is and negative values as the one's complement of
+    their absolute value, using `size` bits.
+
+    Args:
+        amplitudes: The integer amplitudes
+        sizes: The number of bits of each amplitude
+    Returns:
+        The amplitude bits as unsigned integers
+    """
+    amplitudes = np.asarray(amplitudes, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    bits = np.where(amplitudes < 0, amplitudes - 1, amplitudes) & ((1 << sizes) - 1)
+    return bits.astype(np.uint64)
+
+
+class BitWriter:
+    def __init__(self, capacity=1 << 16):
+        """
+        Pack variable length codewords into a preallocated bytearray. The
+        codewords are packed into 64-bit words at once and the 0xFF bytes
+        are stuffed with a 0x00 byte as required inside a JPEG scan.
+
+        Args:
+            capacity: The initial capacity of the buffer in bytes
+        """
+        self.buffer = bytearray(capacity)
+        self.size = 0
+        self.word = 0
+        self.word_bits = 0
+
+    def write(self, codes, lengths):
+        """
+        Write a sequence of codewords
+
+        Args:
+            codes: The codewords, right aligned
+            lengths: The length in bits of each codeword, at most 32
+        """
+        codes = np.asarray(codes, dtype=np.uint64)
+        lengths = np.asarray(lengths, dtype=np.uint64)
+        if len(codes) == 0:
+            return
+
+        ends = np.cumsum(lengths, dtype=np.uint64) + np.uint64(self.word_bits)
+        starts = ends - lengths
+        total_bits = int(ends[-1])
+
+        word_indexes = starts >> np.uint64(6)
+        offsets = starts & np.uint64(63)
+        fits = offsets + lengths <= np.uint64(64)
+
+        # Part of each codeword in the word where it starts
+        shifts = np.where(fits, np.uint64(64) - offsets - lengths, offsets + lengths - np.uint64(64))
+        heads = np.where(fits, codes << shifts, codes >> shifts)
+        words = np.zeros((total_bits + 63) // 64, dtype=np.uint64)
+        group_starts = np.flatnonzero(np.diff(word_indexes, prepend=np.uint64(len(words) + 1)))
+        words[word_indexes[group_starts]] = np.bitwise_or.reduceat(heads, group_starts)
+        words[0] |= np.uint64(self.word)
+
+        # Remaining part of the codewords that straddle two words
+        straddling = ~fits
+        tail_shifts = np.uint64(128) - offsets[straddling] - lengths[straddling]
+        words[word_indexes[straddling] + np.uint64(1)] |= codes[straddling] << tail_shifts
+
+        full_words = total_bits // 64
+        self._write_bytes(words[:full_words].astype('>u8').view(np.uint8))
+        self.word_bits = total_bits % 64
+        self.word = int(words[full_words]) if self.word_bits else 0
+
+    def flush(self):
+        """
+        Pad the last byte with 1 bits and write the pending bits
+        """
+        if self.word_bits == 0:
+            return
+
+        padding = -self.word_bits % 8
+        word = self.word | (((1 << padding) - 1) << (64 - self.word_bits - padding))
+        n_bytes = (self.word_bits + padding) // 8
+        self._write_bytes(np.frombuffer(word.to_bytes(8, 'big')[:n_bytes], dtype=np.uint8))
+        self.word = 0
+        self.word_bits = 0
+
+    def write_to(self, f):
+        """
+        Write the complete bytes to a file and empty the buffer. The pending
+        bits that do not fill a word are kept.
+
+        Args:
+            f: The binary file to write to
+        """
+        f.write(self.getvalue())
+        self.size = 0
+
+    def getvalue(self):
+        """
+        Get the written bytes without copying them
+
+        Returns:
+            A memoryview of the written bytes
+        """
+        return memoryview(self.buffer)[:self.size]
+
+    def _write_bytes(self, data):
+        stuffing = np.flatnonzero(data == 0xFF)
+        if len(stuffing):
+            data = np.insert(data, stuffing + 1, 0)
+        self._reserve(len(data))
+        self.buffer[self.size:self.size + len(data)] = data.tobytes()
+        self.size += len(data)
+
+    def _reserve(self, n_bytes):
+        if self.size + n_bytes > len(self.buffer):
+            self.buffer.extend(bytes(max(len(self.buffer), self.size + n_bytes - len(self.buffer))))
+
+
+def huffman_encode(writer, tables, stream):
+    """
+    Encode a SymbolStream, writing the Huffman code of each symbol followed
+    by its amplitude bits.
+
+    Args:
+        writer: The BitWriter to write the codes to
+        tables: The DC and AC Huffman tables
+        stream: The SymbolStream to encode
+    """
+    table_indexes = stream.table_indexes()
+    symbols = stream.symbols()
+    codes = np.empty(len(stream), dtype=np.uint64)
+    lengths = np.empty(len(stream), dtype=np.uint64)
+    for i, table in enumerate(tables):
+        selected = table_indexes == i
+        codes[selected] = table.codes[symbols[selected]]
+        lengths[selected] = table.lengths[symbols[selected]]
+
+    sizes = stream.sizes.astype(np.uint64)
+    codes = (codes << sizes) | amplitude_bits(stream.amplitudes, sizes)
+    writer.write(codes, lengths + sizes)
+
+
+def optimal_huffman_table(frequencies, max_length=16):
+    """
+    Build the optimal Huffman table for the symbol frequencies, limiting the
+    code lengths to max_length bits (ITU-T T.81, Annex K.2). A reserved
+    symbol is added while building the codes so that no code is made only
+    of 1 bits.
+
+    Args:
+        frequencies: The frequency of each of the 256 symbols
+        max_length: The maximum length of the codes
+    Returns:
+        The HuffmanTable of the symbols that appear in the frequencies
+    """
+    reserved = 256
+    frequencies = {symbol: int(frequency) for symbol, frequency in enumerate(frequencies) if frequency > 0}
+    frequencies[reserved] = 1
+
+    # Huffman tree, each node keeps the symbols below it to update their code size
+    code_sizes = dict.fromkeys(frequencies, 0)
+    nodes = [(frequency, symbol, [symbol]) for symbol, frequency in frequencies.items()]
+    heapq.heapify(nodes)
+    while len(nodes) > 1:
+        frequency1, key1, symbols1 = heapq.heappop(nodes)
+        frequency2, key2, symbols2 = heapq.heappop(nodes)
+        for symbol in symbols1 + symbols2:
+            code_sizes[symbol] += 1
+        heapq.heappush(nodes, (frequency1 + frequency2, min(key1, key2), symbols1 + symbols2))
+    if len(code_sizes) == 1:
+        code_sizes[reserved] = 1
+
+    bits = [0] * (max(max(code_sizes.values()), max_length) + 1)
+    for size in code_sizes.values():
+        bits[size] += 1
+
+    # Move the codes longer than max_length up the tree
+    for i in range(len(bits) - 1, max_length, -1):
+        while bits[i] > 0:
+            j = i - 2
+            while bits[j] == 0:
+                j -= 1
+            bits[i] -= 2
+            bits[i - 1] += 1
+            bits[j + 1] += 2
+            bits[j] -= 1
+
+    # Remove the reserved code, which is one of the longest
+    i = max_length
+    while bits[i] == 0:
+        i -= 1
+    bits[i] -= 1
+
+    values = sorted(code_sizes, key=lambda symbol: (code_sizes[symbol], symbol))
+    values.remove(reserved)
+    return HuffmanTable(bits[1:max_length + 1], values)
+
+
+def decode_scan(data, dc_table, ac_table, n_blocks, block_length=64):
+    """
+    Decode the entropy coded data of a scan segment (without restart
+    markers). The Huffman codes are decoded with the lookup tables of the
+    Huffman tables, reading the next bits from a precomputed 32-bit window
+    at each byte position, so there is no bit by bit tree walk.
+
+    Args:
+        data: The scan segment bytes, with the byte stuffing
+        dc_table: The DC Huffman table
+        ac_table: The AC Huffman table
+        n_blocks: The number of blocks in the segment
+        block_length: The number of coefficients of each block
+    Returns:
+        A (n_blocks, block_length) array with the coefficients of the blocks
+        in zig-zag order, with the DC differences already accumulated
+    """
+    data = np.frombuffer(bytes(data).replace(b'\xff\x00', b'\xff'), dtype=np.uint8)
+    # Pad with 1 bits so reads past the end behave like the flush padding
+    data = np.concatenate([data, np.full(8, 0xFF, dtype=np.uint8)]).astype(np.uint32)
+    windows = array('I', ((data[:-3] << 24) | (data[1:-2] << 16) | (data[2:-1] << 8) | data[3:]).tobytes())
+
+    lookup_shift = 32 - LOOKUP_BITS
+    lookup_mask = (1 << LOOKUP_BITS) - 1
+    tables = (
+        (dc_table.lookup_symbols, dc_table.lookup_lengths, dc_table.max_codes, dc_table.value_offsets, dc_table.values),
+        (ac_table.lookup_symbols, ac_table.lookup_lengths, ac_table.max_codes, ac_table.value_offsets, ac_table.values),
+    )
+
+    indexes = array('q')
+    values = array('q')
+    position = 0
+    previous_DC = 0
+    for block in range(n_blocks):
+        k = 0
+        offset = block * block_length
+        while k < block_length:
+            symbols, lengths, max_codes, value_offsets, table_values = tables[k > 0]
+
+            # Huffman code
+            window = windows[position >> 3] << (position & 7)
+            index = (window >> lookup_shift) & lookup_mask
+            length = lengths[index]
+            if length:
+                symbol = symbols[index]
+            else:
+                code = (window >> 16) & 0xFFFF
+                for length in range(LOOKUP_BITS + 1, 17):
+                    if (code >> (16 - length)) <= max_codes[length]:
+                        break
+                else:
+                    raise ValueError("Invalid Huffman code in the scan data")
+                symbol = table_values[value_offsets[length] + (code >> (16 - length))]
+            position += length
+
+            size = symbol & 15
+            if size:
+                amplitude = ((windows[position >> 3] << (position & 7)) >> (32 - size)) & ((1 << size) - 1)
+                position += size
+                if amplitude < (1 << (size - 1)):
+                    amplitude -= (1 << size) - 1
+            else:
+                amplitude = 0
+
+            if k == 0:
+                previous_DC += amplitude
+                if previous_DC:
+                    indexes.append(offset)
+                    values.append(previous_DC)
+                k = 1
+            elif size:
+                k += symbol >> 4
+                indexes.append(offset + k)
+                values.append(amplitude)
+                k += 1
+            elif symbol == 0xF0:
+                k += 16
+            else:
+                break
+
+    coefficients = np.zeros(n_blocks * block_length, dtype=np.int32)
+    coefficients[np.frombuffer(indexes, dtype=np.int64)] = np.frombuffer(values, dtype=np.int64)
+    return coefficients.reshape(n_blocks, block_length)
@@ -1,12 +1,25 @@
+import io
 import math
+import os
+import re
 import numpy as np
 import struct as st
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-from scipy.fftpack import dct, idct
-import matplotlib.pyplot as plt
 from PIL import Image
 
-from onas.gui import StepsFrame
+from onas.codecs.transforms import DCT_IMPLEMENTATIONS, DCTTransform, FFTTransform, KLTTransform, matrix_dct, matrix_idct
+from onas.codecs.huffman import BitWriter, HuffmanTable, decode_scan, huffman_encode, optimal_huffman_table
+from onas.codecs.symbols import SymbolStream
+from onas.utils.cache import LRUCache, array_hash
+from onas.utils.metrics import psnr
+from onas.utils.profiling import profiled
+from onas.utils.streams import OutputStream
+from onas.utils.blocks import PADDING_MODES, bit_lengths, tile_image, untile_image, zig_zag_indices
+
+# Size in bytes of the float chunks the int16 coefficients of single precision are quantized and unquantized in
+CHUNK_BYTES = 2 ** 20
 
 
 class JPEG:
@@ -24,17 +37,15 @@ class JPEG:
             [49, 64, 78, 87, 103, 121, 120, 101],
             [72, 92, 95, 98, 112, 100, 103, 99]
         ])
+        self.quantization_tables = {len(self.quantization_table): self.quantization_table}
         self.codification_steps = None
-
-        self.zig_zag_order = {
-             0:(0, 0),  1:(0, 1),  5:(0, 2),  6:(0, 3), 14:(0, 4), 15:(0, 5), 27:(0, 6), 28:(0, 7),
-             2:(1, 0),  4:(1, 1),  7:(1, 2), 13:(1, 3), 16:(1, 4), 26:(1, 5), 29:(1, 6), 42:(1, 7),
-             3:(2, 0),  8:(2, 1), 12:(2, 2), 17:(2, 3), 25:(2, 4), 30:(2, 5), 41:(2, 6), 43:(2, 7),
-             9:(3, 0), 11:(3, 1), 18:(3, 2), 24:(3, 3), 31:(3, 4), 40:(3, 5), 44:(3, 6), 53:(3, 7),
-            10:(4, 0), 19:(4, 1), 23:(4, 2), 32:(4, 3), 39:(4, 4), 45:(4, 5), 52:(4, 6), 54:(4, 7),
-            20:(5, 0), 22:(5, 1), 33:(5, 2), 38:(5, 3), 46:(5, 4), 51:(5, 5), 55:(5, 6), 60:(5, 7),
-            21:(6, 0), 34:(6, 1), 37:(6, 2), 47:(6, 3), 50:(6, 4), 56:(6, 5), 59:(6, 6), 61:(6, 7),
-            35:(7, 0), 36:(7, 1), 48:(7, 2), 49:(7, 3), 57:(7, 4), 58:(7, 5), 62:(7, 6), 63:(7, 7)
+        self.listeners = []
+        self.stats = None
+        # The transform engines, by the name of the Transform option
+        self.transforms = {
+            "DCT": DCTTransform(),
+            "KLT": KLTTransform(),
+            "FFT": FFTTransform(),
         }
 
         self.jpeg_markers = {
@@ -44,14 +55,24 @@ class JPEG:
             "SOF0": 0xFFC0, # Start of Frame (Baseline DCT)
             "DHT": 0xFFC4,  # Define Huffman Table
             "SOS": 0xFFDA,  # Start of Scan
+            "DRI": 0xFFDD,  # Define Restart Interval
+            "RST0": 0xFFD0, # Restart marker 0 (up to RST7)
             "EOI": 0xFFD9   # End of Image
         }
+        self.huffman_tables = [HuffmanTable.standard_dc(), HuffmanTable.standard_ac()]
+        self.coefficient_cache = LRUCache(0)
+        self.configure()
     
     def options(self) -> dict:
         """
         Return the options for the JPEG compression algorithm
         """
         return {
+            "Transform": {
+                "type": "combobox",
+                "values": list(self.transforms.keys()),
+                "default": "DCT"
+            },
             "Quantization Factor": {
                 "type": "slider",
                 "values": [1, 100, 1],
@@ -62,22 +83,49 @@ class JPEG:
                 "values": ["8", "16", "32", "64", "128"],
                 "default": "8"
             },
+            "DCT Implementation": {
+                "type": "combobox",
+                "values": ["SciPy", "Matrix", "Integer"],
+                "default": "SciPy"
+            },
+            "Precision": {
+                "type": "combobox",
+                "values": ["Double", "Single"],
+                "default": "Double"
+            },
+            "Padding": {
+                "type": "combobox",
+                "values": list(PADDING_MODES.keys()),
+                "default": "Replicate"
+            },
+            "Optimize Huffman": {
+                "type": "switch",
+                "default": False
+            },
         }
     
     def steps(self, steps_parent) -> list:
         """
         Create the steps for the JPEG compression algorithm. The steps are
         described in a list of StepsFrame objects that can be displayed in
-        the GUI.
+        the GUI. The steps listen to the stages they display, replacing the
+        steps created before.
 
         Args:
             steps_parent: The parent frame to place the steps
         Returns:
             A list of StepsFrame objects
         """
+        # The GUI is only imported when it is used, so the codec can be used headless
+        from onas.gui import StepsFrame
+
+        for step in self.codification_steps or []:
+            self.remove_listener(step.on_stage)
+
         self.codification_steps = [ 
             StepsFrame(
                 name="Block creation",
+                stage="tiling",
                 parent=steps_parent,
                 description="""Divide the image into blocks of the selected size. This helps to divide
                             the image into more stationary regions, which can be compressed more
@@ -86,16 +134,19 @@ class JPEG:
             ),
             StepsFrame(
                 name="Direct Transform",
+                stage="transform",
                 parent=steps_parent,
                 description="""Each block is transformed using the selected method. The optimal transform
                             is the Karhunen-Loeve Transform (KLT), which base depends on the current image.
                             However, this will imply sending the base to the receiver, which is not practical.
                             On the other hand, the Discrete Cosine Transform (DCT) base is fixed and a good
                             approximation of the KLT and is used in practice (as the bases are known by both
-                            the sender and the receiver we don't need to send them)""",
+                            the sender and the receiver we don't need to send them). The FFT has a fixed base
+                            too, but it compacts less energy as it treats each block as periodic""",
             ),
             StepsFrame(
                 name="Quantization",
+                stage="quantization",
                 parent=steps_parent,
                 description="""Based on psycho-visual studies, a different quantization step is used
                             for each transform coefficient. The compression can be controlled by multiplying
@@ -112,6 +163,7 @@ class JPEG:
             ),
             StepsFrame(
                 name="Zig-zag scan",
+                stage="zig-zag",
                 parent=steps_parent,
                 description="""The transformed coefficients are scanned in a zig-zag pattern, so that
                             the most important coefficients are first and the high-frequency coefficients
@@ -125,6 +177,8 @@ class JPEG:
                             and the previous coefficient, are encoded using Huffman encoding and the AC Huffman table""",
             ),
         ]
+        for step in self.codification_steps:
+            self.add_listener(step.on_stage)
         return self.codification_steps
     
     def configure(self, **kwargs) -> None:
@@ -136,144 +190,690 @@ class JPEG:
         """
         self.quantization_factor = int(kwargs.get("Quantization Factor", 1))
         self.block_size = int(kwargs.get("Block Size", "8"))
+        self.padding = kwargs.get("Padding", "Replicate")
+        if self.padding not in PADDING_MODES:
+            raise ValueError(f"Unknown padding: {self.padding}")
+        self.dct_implementation = kwargs.get("DCT Implementation", "SciPy")
+        if self.dct_implementation not in DCT_IMPLEMENTATIONS:
+            raise ValueError(f"Unknown DCT implementation: {self.dct_implementation}")
+        self.transform_name = kwargs.get("Transform", "DCT")
+        if self.transform_name not in self.transforms:
+            raise ValueError(f"Unknown transform: {self.transform_name}")
+        self.transform = self.transforms[self.transform_name]
+        self.transforms["DCT"].implementation = self.dct_implementation
+        # Single precision transforms in float32 and stores the quantized coefficients as int16
+        self.precision = kwargs.get("Precision", "Double")
+        if self.precision not in ("Double", "Single"):
+            raise ValueError(f"Unknown precision: {self.precision}")
+        self.dtype = np.float32 if self.precision == "Single" else np.float64
+        self.optimize_huffman = bool(kwargs.get("Optimize Huffman", False))
+        self.workers = int(kwargs.get("workers", 1))
+        self.restart_rows = int(kwargs.get("restart_rows", 0))
+        self.target_bytes = int(kwargs["target_bytes"]) if kwargs.get("target_bytes") else None
+        self.target_psnr = float(kwargs["target_psnr"]) if kwargs.get("target_psnr") else None
+        if self.target_bytes and self.target_psnr:
+            raise ValueError("Only one of target_bytes and target_psnr can be set")
+        # The cache (in MB) only pays off when the same image is coded again, like in the GUI,
+        # so it is off by default: otherwise every call hashes the image and copies its coefficients
+        self.coefficient_cache.budget = int(float(kwargs.get("cache_budget", 0)) * 2 ** 20)
+        self.coefficient_cache.evict()
+        # False, True to time the stages or "memory" to also trace their memory peak
+        self.profile = kwargs.get("profile", False)
+        self.configuration = dict(kwargs)
     
+    def add_listener(self, listener):
+        """
+        Register a function to call when each stage of the compression
+        finishes, as listener(stage, snapshot). The snapshot is a small
+        sample of the result of the stage (the 9 blocks shown in the GUI for
+        the block stages, the scan order for the zig-zag scan) or None. A
+        listener can abort the compression by raising an exception.
+
+        Args:
+            listener: The function to call
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def _notify(self, stage, snapshot=None):
+        """
+        Call the listeners at the end of a stage. Nothing is done if there
+        are no listeners, the snapshot is only taken if there are.
+
+        Args:
+            stage: The name of the stage
+            snapshot: A function that returns the snapshot of the stage
+        """
+        if not self.listeners:
+            return
+        snapshot = snapshot() if snapshot else None
+        for listener in self.listeners:
+            listener(stage, snapshot)
+
     def is_standard(self):
         """
-        Check if the block size is 8x8, which is the standard for JPEG compression
+        Check if the blocks are 8x8 DCT blocks, which is the standard for JPEG compression
+
+        Returns:
+            True if the transform is the DCT and the block size is 8x8, False otherwise
+        """
+        return self.block_size == 8 and self.transform_name == "DCT"
+
+    def side_information(self) -> int:
+        """
+        Get the bytes the selected transform needs to send besides the
+        coefficients, like the basis of the KLT
+
+        Returns:
+            The size of the side information in bytes
+        """
+        return self.transform.side_information(self.block_size)
+
+    @profiled
+    def __call__(self, image, file_out=None, out=None, shape=None):
+        """
+        Main method to do the JPEG compression. If a target size or PSNR is
+        configured, the quantization factor is searched first and kept in
+        quantization_factor, and the coefficients transformed for the search
+        are quantized again for the final pass. If profiling is enabled, the
+        StageStats of the call are kept in stats.
+
+        Args:
+            image: The image to compress, any source accepted by _open_source.
+                   Arrays, memory-mapped files and raw buffers are used
+                   without copying them
+            file_out: The path, writable binary stream or preallocated
+                      writable buffer to save the compressed image to
+            out: A uint8 array of the image shape to reuse for the reconstructed image
+            shape: The (height, width) of a raw 8-bit source
 
         Returns:
-            True if the block size is 8x8, False otherwise
+            The compressed image if file_out is None, otherwise the size in
+            bytes of the compressed image
         """
-        return self.block_size == 8
+        image = self._read_image(image, shape)
+        self._notify("read")
+
+        transformed_blocks = None
+        if self.target_bytes or self.target_psnr:
+            # Read-only, so every pass quantizes them into a new array
+            transformed_blocks = self._coefficients(image)
+            transformed_blocks.flags.writeable = False
+            self.quantization_factor = self._search_quantization_factor(image, transformed_blocks)
+
+        if file_out is None:
+            return self._reconstruct_image(self._quantize_image(image, transformed_blocks), image.shape, out)
+
+        # Streams and buffers can't be rewritten, so if the image may have to
+        # be compressed again to fit the target size it is compressed in memory
+        encoded = io.BytesIO() if self.target_bytes and not isinstance(file_out, (str, os.PathLike)) else file_out
+        size = self._compress_to_file(image, encoded, transformed_blocks)
+        # The size estimate doesn't count the stuffed bytes of the scan, which
+        # can rarely push the file over the target by a few bytes
+        while self.target_bytes and size > self.target_bytes:
+            if self.quantization_factor >= 100:
+                raise ValueError(f"Cannot compress the image to {self.target_bytes} bytes")
+            self.quantization_factor += 1
+            if encoded is not file_out:
+                encoded = io.BytesIO()
+            size = self._compress_to_file(image, encoded, transformed_blocks)
+
+        if encoded is not file_out:
+            with OutputStream(file_out) as f:
+                f.write(encoded.getbuffer())
+        return size
 
-    def __call__(self, image, file_out: str=None):
+    def _quantize_image(self, image, transformed_blocks=None):
         """
-        Main method to do the JPEG compression
+        Transform and quantize the blocks of the image
+
+        Args:
+            image: The image to quantize
+            transformed_blocks: The transformed blocks of the image, if they
+                are already known. Read-only blocks are left untouched
+        Returns:
+            The quantized blocks
+        """
+        if transformed_blocks is None:
+            transformed_blocks = self._coefficients(image)
+        out = None
+        # The cached blocks are read-only, single precision quantizes them into a new int16 array anyway
+        if not transformed_blocks.flags.writeable and self.precision == "Double":
+            out = np.empty_like(transformed_blocks)
+        return self._quantize_blocks(transformed_blocks, out)
+
+    def _compress_to_file(self, image, file_out, transformed_blocks=None):
+        """
+        Compress the image to a file, split in restart intervals if there is
+        more than one worker or the restart interval is set
 
         Args:
             image: The image to compress
-            file_out: The path to save the compressed image
+            file_out: The path, stream or buffer to save the compressed image to
+            transformed_blocks: The read-only transformed blocks of the image, if they are already known
+        Returns:
+            The size in bytes of the compressed image
+        """
+        if self.workers > 1 or self.restart_rows:
+            return self._save_image_intervals(image, file_out, transformed_blocks)
+        return self._save_image(self._quantize_image(image, transformed_blocks), file_out, image.shape)
+
+    def _search_quantization_factor(self, image, transformed_blocks):
+        """
+        Search the quantization factor that meets the target size or PSNR by
+        bisection over the factors from 1 to 100. The image is transformed
+        once and every step only quantizes the coefficients and estimates
+        the result: the size from the Huffman code lengths of the symbols and
+        the PSNR from the quantization error of the coefficients.
+
+        For a target size the smallest factor that fits is returned, for a
+        target PSNR the biggest factor that reaches it. The estimated PSNR
+        is off by a fraction of a dB, as it ignores the rounding and clipping
+        of the pixels, so the factor found is corrected with the PSNR of the
+        reconstructed image.
 
+        Args:
+            image: The image to compress
+            transformed_blocks: The read-only transformed blocks of the image
         Returns:
-            The compressed image if file_out is None, None otherwise as the image is saved to disk
+            The quantization factor
         """
-        if isinstance(image, str):
-            image = np.array(Image.open(image).convert('L'))
+        if self.target_bytes:
+            def meets_target(factor):
+                return self._estimate_size(transformed_blocks, factor, image.shape) <= self.target_bytes
+        else:
+            def meets_target(factor):
+                return self._estimate_psnr(transformed_blocks, factor) >= self.target_psnr
 
-        blocks = self._create_image_blocks(image, self.block_size)
-        transformed_blocks = self._transform_blocks(blocks)
-        quantized_blocks = self._quantize_blocks(transformed_blocks)
+        # Bigger factors meet a target size and smaller ones a target PSNR
+        low, high = 1, 100
+        if self.target_bytes:
+            if not meets_target(high):
+                raise ValueError(f"Cannot compress the image to {self.target_bytes} bytes")
+            while low < high:
+                middle = (low + high) // 2
+                if meets_target(middle):
+                    high = middle
+                else:
+                    low = middle + 1
+            return low
+
+        if meets_target(low):
+            while low < high:
+                middle = (low + high + 1) // 2
+                if meets_target(middle):
+                    low = middle
+                else:
+                    high = middle - 1
+        return self._correct_psnr_factor(image, transformed_blocks, low)
+
+    def _correct_psnr_factor(self, image, transformed_blocks, quantization_factor):
+        """
+        Find the biggest quantization factor whose reconstructed image reaches
+        the target PSNR, starting from an estimated one. The factors are
+        stepped from it by doubling steps until one misses (or reaches) the
+        target, and the last step is bisected, so a good estimate only costs
+        two reconstructions.
 
-        if file_out:
-            self._save_image(quantized_blocks, file_out)
+        Args:
+            image: The image to compress
+            transformed_blocks: The read-only transformed blocks of the image
+            quantization_factor: The estimated quantization factor
+        Returns:
+            The quantization factor
+        """
+        def meets_target(factor):
+            self.quantization_factor = factor
+            reconstructed = self._reconstruct_image(self._quantize_image(image, transformed_blocks), image.shape)
+            return psnr(image, reconstructed) >= self.target_psnr
+
+        # The factors from low up meet the target and the ones from high up
+        # miss it, 0 and 101 stand for the factors out of the range
+        low, high, step = quantization_factor, quantization_factor, 1
+        if meets_target(quantization_factor):
+            while high <= 100:
+                high = min(low + step, 101)
+                if high == 101 or not meets_target(high):
+                    break
+                low, step = high, step * 2
         else:
-            return self._reconstruct_image(quantized_blocks, image.shape) 
+            while low > 0:
+                low = max(high - step, 0)
+                if low == 0 or meets_target(low):
+                    break
+                high, step = low, step * 2
+            if low == 0:
+                raise ValueError(f"Cannot compress the image with a PSNR of {self.target_psnr} dB")
+
+        while high - low > 1:
+            middle = (low + high) // 2
+            if meets_target(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def _estimate_size(self, transformed_blocks, quantization_factor, image_shape):
+        """
+        Estimate the size of the file of the image without packing the bits:
+        the headers plus the Huffman code and amplitude bits of the symbols
+
+        Args:
+            transformed_blocks: The transformed blocks of the image
+            quantization_factor: The quantization factor
+            image_shape: The shape of the image
+        Returns:
+            The estimated size in bytes
+        """
+        quantized_blocks = np.rint(transformed_blocks / self._quantization_matrix(quantization_factor).astype(transformed_blocks.dtype))
+        frequencies, amplitude_bits = 0, 0
+        for stream in self._encode_values(quantized_blocks):
+            frequencies = frequencies + stream.frequencies()
+            amplitude_bits += int(stream.sizes.sum())
+
+        if self.optimize_huffman:
+            huffman_tables = [optimal_huffman_table(table_frequencies) for table_frequencies in frequencies]
+        else:
+            huffman_tables = self.huffman_tables
+        code_bits = sum(int(table_frequencies @ table.lengths.astype(np.int64)) for table_frequencies, table in zip(frequencies, huffman_tables))
+
+        headers = self._headers(image_shape[0], image_shape[1], huffman_tables)
+        return len(headers) + -(-(code_bits + amplitude_bits) // 8) + 2
+
+    def _estimate_psnr(self, transformed_blocks, quantization_factor):
+        """
+        Estimate the PSNR of the image from the quantization error of the
+        coefficients, which is the error of the pixels for the orthonormal
+        transforms except for the final rounding and clipping
+
+        Args:
+            transformed_blocks: The transformed blocks of the image
+            quantization_factor: The quantization factor
+        Returns:
+            The estimated PSNR in dB
+        """
+        quantization_matrix = self._quantization_matrix(quantization_factor).astype(transformed_blocks.dtype)
+        error = np.rint(transformed_blocks / quantization_matrix)
+        error *= quantization_matrix
+        error -= transformed_blocks
+        mse = np.mean(error ** 2)
+        return 10 * np.log10(255 ** 2 / mse) if mse else math.inf
+
+    @profiled
+    def encode_stream(self, source, file_out, strip_rows: int=64, shape=None):
+        """
+        Compress an image strip by strip, writing each strip to the file as
+        soon as it is encoded. Only a strip of the image is in memory at any
+        time, so images bigger than the memory can be compressed as long as
+        the source can be read by strips: arrays (np.memmap included), .npy
+        files (memory-mapped), raw 8-bit files (memory-mapped, shape needed)
+        and files that PIL can open (uncompressed formats like BMP, PPM or
+        TIFF are memory-mapped by PIL, other formats are decoded on open).
+        The file is the same as the one written by calling the codification,
+        restart intervals included: the strips are cut at their boundaries.
+
+        Args:
+            source: The image to compress, any source accepted by _open_source
+            file_out: The path, writable binary stream or preallocated
+                      writable buffer to save the compressed image to
+            strip_rows: The number of rows of blocks (MCU rows) of each strip
+            shape: The (height, width) of a raw source
+        Returns:
+            The size in bytes of the compressed image
+        """
+        if not self.is_standard():
+            raise ValueError("Cannot save image when the blocks are not 8x8 DCT blocks")
+        if self.target_bytes or self.target_psnr:
+            raise ValueError("Target sizes and PSNRs need the whole image and cannot be streamed")
+
+        image = self._open_source(source, shape)
+        height, width = (image.height, image.width) if isinstance(image, Image.Image) else image.shape[:2]
+        rows, cols = -(-height // self.block_size), -(-width // self.block_size)
+        restarts = self.workers > 1 or self.restart_rows
+        interval_rows = self._interval_rows(rows, cols) if restarts else rows
+        # The (first_row, last_row) of blocks of each strip, without crossing the intervals
+        strips = [
+            (row, min(row + strip_rows, start + interval_rows, rows))
+            for start in range(0, rows, interval_rows)
+            for row in range(start, min(start + interval_rows, rows), strip_rows)
+        ]
+
+        def encoded_strips():
+            previous_DC = 0
+            for first_row, last_row in strips:
+                strip = self._read_strip(image, first_row * self.block_size, min(last_row * self.block_size, height))
+                blocks = self._create_image_blocks(strip, self.block_size)
+                quantized_blocks = self._quantize_blocks(self._transform_blocks(blocks))
+                # The DC prediction starts again from 0 at each interval
+                if first_row % interval_rows == 0:
+                    previous_DC = 0
+                yield first_row, self._encode_values(quantized_blocks, previous_DC=previous_DC)
+                previous_DC = quantized_blocks[-1, -1, 0, 0]
+
+        huffman_tables = self._huffman_tables(stream for _, streams in encoded_strips() for stream in streams)
+        writer = BitWriter()
+        with OutputStream(file_out) as f:
+            f.write(self._headers(height, width, huffman_tables, interval_rows * cols if restarts else 0))
+            for first_row, streams in encoded_strips():
+                if first_row and first_row % interval_rows == 0:
+                    writer.flush()
+                    writer.write_to(f)
+                    f.write(st.pack('>H', self.jpeg_markers["RST0"] + (first_row // interval_rows - 1) % 8))
+                for stream in streams:
+                    huffman_encode(writer, huffman_tables, stream)
+                    self._notify("entropy coding")
+                    writer.write_to(f)
+                    self._notify("write")
+            writer.flush()
+            writer.write_to(f)
+            f.write(st.pack('>H', self.jpeg_markers["EOI"]))
+        self._notify("write")
+        return f.size
+
+    def _open_source(self, source, shape=None):
+        """
+        Open an image source without reading its pixels. With a shape the
+        source holds raw 8-bit pixels, row by row, otherwise it is an image
+        file that PIL can open (or a .npy file if it is a path). Raw paths,
+        buffers and files are mapped or viewed without copying their pixels,
+        except for streams that are not files, which are read into an array.
+
+        Args:
+            source: An array (np.memmap included), the path of a .npy, raw or
+                    image file, a buffer (bytes, bytearray, memoryview,
+                    mmap...) or a binary file-like object
+            shape: The (height, width) of a raw source
+        Returns:
+            An array (possibly memory-mapped or a view of the buffer) or a PIL image
+        """
+        if isinstance(source, np.ndarray):
+            return source
+        if isinstance(source, (str, os.PathLike)):
+            if os.fspath(source).endswith('.npy'):
+                return np.load(source, mmap_mode='r')
+            if shape is not None:
+                return np.memmap(source, dtype=np.uint8, mode='r', shape=tuple(shape))
+            return Image.open(source)
+
+        if hasattr(source, 'read') and not isinstance(source, io.BytesIO):
+            if shape is None:
+                return Image.open(source)
+            try:
+                return np.memmap(source, dtype=np.uint8, mode='r', offset=source.tell(), shape=tuple(shape))
+            except (AttributeError, OSError, ValueError):
+                # Streams without a file behind them are read into the array
+                image = np.empty(tuple(shape), dtype=np.uint8)
+                buffer, position = memoryview(image).cast('B'), 0
+                while position < image.size:
+                    read = source.readinto(buffer[position:])
+                    if not read:
+                        raise ValueError("The raw source is smaller than its shape")
+                    position += read
+                return image
+
+        # BytesIO is read through its buffer, without copying it
+        buffer = source.getbuffer() if isinstance(source, io.BytesIO) else memoryview(source)
+        if shape is None:
+            return Image.open(io.BytesIO(buffer))
+        return np.frombuffer(buffer, dtype=np.uint8, count=shape[0] * shape[1]).reshape(shape)
+
+    def _read_image(self, source, shape=None):
+        """
+        Read a whole image source as a grayscale array. 2D uint8 arrays,
+        including memory-mapped and buffer sources, are not copied.
+
+        Args:
+            source: Any source accepted by _open_source
+            shape: The (height, width) of a raw source
+        Returns:
+            The 2D uint8 image
+        """
+        image = self._open_source(source, shape)
+        if isinstance(image, Image.Image):
+            return np.asarray(image.convert('L'))
+        return self._read_strip(image, 0, len(image))
+
+    def _read_strip(self, image, top, bottom):
+        """
+        Read the rows top:bottom of an image source as a grayscale array
+
+        Args:
+            image: An array or a PIL image
+            top: The first row of the strip
+            bottom: The row after the last row of the strip
+        Returns:
+            The 2D uint8 strip
+        """
+        if isinstance(image, Image.Image):
+            return np.asarray(image.crop((0, top, image.width, bottom)).convert('L'))
+        strip = np.asarray(image[top:bottom])
+        if strip.ndim == 3:
+            strip = np.asarray(Image.fromarray(strip).convert('L'))
+        return strip
 
     def _create_image_blocks(self, image, block_size):
         """
-        Create blocks of the specified size from the image
+        Create blocks of the specified size from the image. The blocks are a
+        view of the image, partial blocks on the edges are padded using the
+        selected padding mode.
 
         Args:
             image: The image to divide into blocks
             block_size: The size of the blocks
         Returns:
-            A list of blocks
+            A (rows, cols, block_size, block_size) array of blocks
         """
-        blocks = []
-        for i in range(0, image.shape[0], block_size):
-            for j in range(0, image.shape[1], block_size):
-                blocks.append(image[i:i+block_size, j:j+block_size])
+        blocks = tile_image(image, block_size, self.padding)
+
+        self._notify("tiling", lambda: self._sample_blocks(blocks))
 
-        # Display the blocks if plotting is enabled
-        if self.codification_steps:
-            for i in range(9):
-                plot = self.codification_steps[0].get_plot(3, 3, i+1)
-                plot.imshow(blocks[len(blocks)//2 + i], cmap='gray')
-                plot.axis('off')
-            self.codification_steps[0].update_plot()
-        
         return blocks
 
-    def _transform_blocks(self, blocks):
+    def _sample_blocks(self, blocks):
         """
-        Transform the blocks using the selected algorithm
+        Copy 9 blocks from the middle of the image, to publish them to the listeners
 
         Args:
-            blocks: The blocks to transform
+            blocks: The (rows, cols, block_size, block_size) blocks
+        Returns:
+            A (9, block_size, block_size) array with the sampled blocks
+        """
+        flat_blocks = blocks.reshape(-1, blocks.shape[-2], blocks.shape[-1])
+        return flat_blocks[(len(flat_blocks) // 2 + np.arange(9)) % len(flat_blocks)]
+
+    def _cache_key(self, image_key):
+        """
+        Get the key of the cached results of an image, made of the hash of
+        the image and the settings that change its coefficients
+
+        Args:
+            image_key: The hash of the image
+        Returns:
+            The key
+        """
+        return (image_key, self.block_size, self.padding, self.transform_name, self.dct_implementation, self.precision)
+
+    def _coefficients(self, image, image_key=None):
+        """
+        Get the transformed blocks of the image. The transformed blocks are
+        kept in an LRU cache keyed by the content of the image and the
+        settings that change them, so a change that only affects the
+        quantization doesn't transform the image again. The cached blocks
+        are read-only.
+
+        Args:
+            image: The image to transform
+            image_key: The hash of the image, if it is already known
+        Returns:
+            The (rows, cols, block_size, block_size) transformed blocks
+        """
+        if not self.coefficient_cache.budget:
+            return self._transform_blocks(self._create_image_blocks(image, self.block_size))
+
+        if image_key is None:
+            image_key = array_hash(image)
+        key = self._cache_key(image_key)
+        transformed_blocks = self.coefficient_cache.get(key)
+        if transformed_blocks is None:
+            transformed_blocks = self._transform_blocks(self._create_image_blocks(image, self.block_size), image_key)
+            self.coefficient_cache.put(key, transformed_blocks)
+        else:
+            if self.listeners or self.transform.adaptive:
+                blocks = self._create_image_blocks(image, self.block_size)
+                # The inverse transform needs the basis of the image
+                if self.transform.adaptive:
+                    self.transform.fit(np.subtract(blocks, 128, dtype=self.dtype), (image_key, self.block_size, self.padding))
+            self._notify("transform", lambda: self._sample_blocks(transformed_blocks))
+        return transformed_blocks
+
+    def _transform_blocks(self, blocks, image_key=None):
+        """
+        Transform the blocks using the selected algorithm. All the blocks are
+        transformed at once. Adaptive transforms are fitted to the blocks
+        first, reusing the basis fitted before for the same image.
+
+        Args:
+            blocks: The (rows, cols, block_size, block_size) blocks to transform
+            image_key: The hash of the image, to cache the basis of adaptive transforms
         Returns:
             The transformed blocks
         """
-        transformed_blocks = [self._dct(block) for block in blocks]
+        # Level shift the samples so they are centered around zero
+        blocks = np.subtract(blocks, 128, dtype=self.dtype)
+        if self.transform.adaptive:
+            self.transform.fit(blocks, image_key and (image_key, self.block_size, self.padding))
+        transformed_blocks = self.transform.forward(blocks)
 
-        # Display the transformed blocks if plotting is enabled
-        if self.codification_steps:
-            for i in range(9):
-                plot = self.codification_steps[1].get_plot(3, 3, i+1)
-                plot.imshow(transformed_blocks[len(transformed_blocks)//2 + i], cmap='gray')
-                plot.axis('off')
-            self.codification_steps[1].update_plot()
+        self._notify("transform", lambda: self._sample_blocks(transformed_blocks))
 
         return transformed_blocks
 
-    def _inverse_transform_blocks(self, blocks):
+    def _inverse_transform_blocks(self, blocks, transform=None):
         """
         Inverse transform the blocks using the selected algorithm
 
         Args:
-            blocks: The transformed blocks
+            blocks: The (rows, cols, block_size, block_size) transformed blocks
+            transform: The transform engine, by default the selected one
         Returns:
             The untransformed blocks
         """
-        return [self._inverse_dct(block) for block in blocks]
+        if transform is None:
+            transform = self.transform
+        untransformed_blocks = transform.inverse(blocks)
+        untransformed_blocks += 128
+        return untransformed_blocks
 
-    def _quantize_blocks(self, transformed_blocks):
+    def _quantization_table(self, block_size):
         """
-        Quantize the transformed blocks using the quantization factor. 
-        Can only be used with the DCT transform and the standard block size of 8x8.
+        Get the quantization table for the block size. The 8x8 table is used
+        as is, tables for bigger blocks are derived from it by interpolating
+        it over the normalized frequencies of the block. The tables are cached.
 
         Args:
-            blocks: The transformed blocks
+            block_size: The size of the blocks
+        Returns:
+            The (block_size, block_size) quantization table
+        """
+        if block_size not in self.quantization_tables:
+            size = len(self.quantization_table)
+            frequencies = np.arange(block_size) * size / block_size
+            indexes = np.arange(size)
+            rows = np.array([np.interp(frequencies, indexes, row) for row in self.quantization_table])
+            table = np.array([np.interp(frequencies, indexes, column) for column in rows.T]).T
+            self.quantization_tables[block_size] = table
+        return self.quantization_tables[block_size]
+
+    def _quantization_matrix(self, quantization_factor=None):
+        """
+        Get the quantization steps, the quantization table scaled by the
+        quantization factor. The steps of the standard 8x8 blocks are limited
+        to 255, the biggest step a baseline JPEG file can store.
+
+        Args:
+            quantization_factor: The factor to scale the table, by default the configured one
+        Returns:
+            The (block_size, block_size) quantization steps
+        """
+        if quantization_factor is None:
+            quantization_factor = self.quantization_factor
+        quantization_matrix = quantization_factor * self._quantization_table(self.block_size)
+        if self.is_standard():
+            quantization_matrix = np.clip(quantization_matrix, 1, 255)
+        return quantization_matrix
+
+    def _chunk_rows(self, blocks):
+        """
+        Get the number of rows of blocks of each chunk of CHUNK_BYTES in the
+        float type of the precision
+
+        Args:
+            blocks: The (rows, cols, block_size, block_size) blocks
+        Returns:
+            The number of rows of blocks, at least one
+        """
+        return max(1, CHUNK_BYTES // (blocks[0].size * np.dtype(self.dtype).itemsize))
+
+    def _quantize_blocks(self, transformed_blocks, out=None):
+        """
+        Quantize the transformed blocks using the quantization factor. All the
+        blocks are quantized at once. With single precision the quantized
+        blocks are returned as int16, which holds any quantized coefficient
+        as they are at most 128 * block_size. They are quantized by chunks of
+        rows in a reused float buffer, so no float copy of all the blocks is
+        made and the transformed blocks are left untouched.
+
+        Args:
+            transformed_blocks: The (rows, cols, block_size, block_size) transformed blocks
+            out: The float array to quantize the blocks into with double
+                 precision, by default the transformed blocks are quantized in place
         
         Returns:
             The quantized blocks
         """
-        if not self.is_standard():
-            return transformed_blocks
-
-        for block in transformed_blocks:
-            for i in range(len(self.quantization_table)):
-                for j in range(len(self.quantization_table[0])):
-                    block[i][j] = round(block[i][j] / (self.quantization_factor * self.quantization_table[i][j]))
-
-        # Display the quantized blocks if plotting is enabled
-        if self.codification_steps:
-            for i in range(9):
-                plot = self.codification_steps[2].get_plot(3, 3, i+1)
-                plot.imshow(transformed_blocks[len(transformed_blocks)//2 + i], cmap='gray')
-                plot.axis('off')
-            self.codification_steps[2].update_plot()
+        if self.precision == "Single":
+            quantization_matrix = self._quantization_matrix().astype(transformed_blocks.dtype)
+            out = np.empty(transformed_blocks.shape, dtype=np.int16)
+            chunk_rows = self._chunk_rows(transformed_blocks)
+            buffer = np.empty((min(chunk_rows, len(transformed_blocks)),) + transformed_blocks.shape[1:], dtype=transformed_blocks.dtype)
+            for top in range(0, len(transformed_blocks), chunk_rows):
+                chunk = transformed_blocks[top:top + chunk_rows]
+                quantized = buffer[:len(chunk)]
+                np.divide(chunk, quantization_matrix, out=quantized)
+                np.rint(quantized, out=quantized)
+                np.copyto(out[top:top + chunk_rows], quantized, casting='unsafe')
+        else:
+            if out is None:
+                out = transformed_blocks
+            np.divide(transformed_blocks, self._quantization_matrix().astype(out.dtype), out=out)
+            np.round(out, out=out)
+
+        self._notify("quantization", lambda: self._sample_blocks(out))
                 
-        return transformed_blocks
+        return out
     
-    def _unquantize_blocks(self, quantized_blocks):
+    def _unquantize_blocks(self, quantized_blocks, out=None, quantization_matrix=None):
         """
-        Unquantize the quantized blocks using the quantization factor. 
-        Can only be used with the DCT transform and the standard block size of 8x8.
+        Unquantize the quantized blocks using the quantization factor. All the
+        blocks are unquantized at once.
 
         Args:
-            quantized_blocks
+            quantized_blocks: The (rows, cols, block_size, block_size) quantized blocks
+            out: The array to store the unquantized blocks, by default the
+                 quantized blocks are unquantized in place, or in a new
+                 array of the float type of the precision if they are integers
+            quantization_matrix: The quantization steps, by default the ones
+                 of the current configuration
         Returns:
             The unquantized blocks
         """
-        if not self.is_standard():
-            return quantized_blocks
-        
-        for block in quantized_blocks:
-            for i in range(len(self.quantization_table)):
-                for j in range(len(self.quantization_table[0])):
-                    block[i][j] = block[i][j] * (self.quantization_factor * self.quantization_table[i][j])
-        
-        return quantized_blocks
+        if out is None and quantized_blocks.dtype == self.dtype:
+            out = quantized_blocks
+        if quantization_matrix is None:
+            quantization_matrix = self._quantization_matrix()
+        return np.multiply(quantized_blocks, quantization_matrix.astype(self.dtype), out=out)
 
     def _dct(self, block, fast_implementation = True):
         """
@@ -283,126 +883,580 @@ class JPEG:
         as it is energypreserving and the coefficients are real numbers. 
         The DCT is used in JPEG compression.
 
+        The fast implementation accepts any stack of blocks (the last two
+        axes are transformed) and uses scipy, the cached basis matrices or
+        the fixed-point integer transform, depending on the selected DCT
+        implementation. The reference implementation, meant for validation,
+        always multiplies by the cached basis matrices in double precision.
+
         Args:
-            block: The block to transform
-            fast_implementation: Use the fast implementation of the DCT
+            block: The block (or stack of blocks) to transform
+            fast_implementation: Use the selected implementation of the DCT
         Returns:
             The transformed block
         """
-        if fast_implementation:
-            return dct(dct(block, axis=0, norm='ortho'), axis=1, norm='ortho')
-        
-        m, n = self.block_size, self.block_size
-        dct_ret = [[ 0 for _ in range(n)] for _ in range(m)]
-        pi = math.pi
-        
-        for i in range(m):
-            for j in range(n):
-                if (i == 0):
-                    ci = 1 / (m ** 0.5)
-                else:
-                    ci = (2 / m) ** 0.5
-                if (j == 0):
-                    cj = 1 / (n ** 0.5)
-                else:
-                    cj = (2 / n) ** 0.5
-        
-                sum = 0
-                for k in range(m):
-                    for l in range(n):
-                    
-                        dct1 = block[k][l] * math.cos((2 * k + 1) * i * pi / (
-                        2 * m)) * math.cos((2 * l + 1) * j * pi / (2 * n))
-                        sum = sum + dct1
- 
-                dct_ret[i][j] = ci * cj * sum
-
-        return dct_ret
+        if not fast_implementation:
+            return matrix_dct(np.asarray(block, dtype=np.float64))
+        return DCT_IMPLEMENTATIONS[self.dct_implementation][0](block)
     
-    def _inverse_dct(self, transformed_block):
+    def _inverse_dct(self, transformed_block, fast_implementation = True):
         """
         Apply the Inverse Discrete Cosine Transform to the block.
 
         Args:
-            block: The transformed block
+            block: The transformed block (or stack of blocks)
+            fast_implementation: Use the selected implementation of the DCT
         Returns:
             The untransformed block
         """
-        return idct(idct(transformed_block, axis=0, norm='ortho'), axis=1, norm='ortho')
+        if not fast_implementation:
+            return matrix_idct(np.asarray(transformed_block, dtype=np.float64))
+        return DCT_IMPLEMENTATIONS[self.dct_implementation][1](transformed_block)
 
-    def _reconstruct_image(self, encoded_blocks, image_shape):
+    def _reconstruct_image(self, encoded_blocks, image_shape, out=None, quantization_matrix=None, transform=None):
         """
-        Reconstruct the image from the encoded blocks. 
+        Reconstruct the image from the encoded blocks. The pixel values are
+        rounded and clipped to the 8-bit range before being written. Integer
+        blocks, as the ones of single precision, are reconstructed by chunks
+        of rows, so they are never unquantized into a float copy of all of them.
 
         Args:
             encoded_blocks: The encoded blocks
             image_shape: The shape of the image
+            out: A uint8 array of the image shape to reuse for the
+                 reconstructed image, it is allocated if not given
+            quantization_matrix: The quantization steps, by default the ones
+                 of the current configuration
+            transform: The transform engine, by default the selected one
         Returns:
             The reconstructed image
         """
-        unquantize_encoded_blocks = self._unquantize_blocks(encoded_blocks)
-        untransformed_blocks = self._inverse_transform_blocks(unquantize_encoded_blocks)
-        reconstructed_image = np.zeros((image_shape[0], image_shape[1]))
-        
-        for i in range(0, image_shape[0], self.block_size):
-            for j in range(0, image_shape[1], self.block_size):
-                reconstructed_image[i:i+self.block_size, j:j+self.block_size] = untransformed_blocks.pop(0)
-        
-        return reconstructed_image
+        chunk_rows = len(encoded_blocks)
+        if np.issubdtype(encoded_blocks.dtype, np.integer):
+            chunk_rows = self._chunk_rows(encoded_blocks)
+        block_size = encoded_blocks.shape[2]
+
+        for top in range(0, len(encoded_blocks), chunk_rows):
+            unquantize_encoded_blocks = self._unquantize_blocks(
+                encoded_blocks[top:top + chunk_rows], quantization_matrix=quantization_matrix
+            )
+            self._notify("inverse quantization")
+            untransformed_blocks = self._inverse_transform_blocks(unquantize_encoded_blocks, transform)
+            np.rint(untransformed_blocks, out=untransformed_blocks)
+            np.clip(untransformed_blocks, 0, 255, out=untransformed_blocks)
+            self._notify("inverse transform")
+
+            if out is None:
+                out = np.empty(image_shape[:2], dtype=np.uint8)
+            untile_image(untransformed_blocks, out=out[top * block_size:(top + chunk_rows) * block_size])
+            self._notify("untiling")
+        return out
+
+    def rd_sweep(self, image, factors=range(1, 101), memory_budget=256 * 2 ** 20, sample_blocks=2 ** 13):
+        """
+        Evaluate the rate-distortion curve of the image for several
+        quantization factors. The image is transformed once (or taken from
+        the coefficient cache) and the factors are evaluated in batches
+        broadcast over the coefficient tensor. The listeners are notified
+        of each batch as a "rate-distortion" stage. The curve doesn't depend
+        on the quantization factor, so it is kept in the cache too.
+
+        The distortion is measured on the coefficients, which is the same as
+        on the pixels for the orthonormal transforms except for the final rounding
+        and clipping. The rate is estimated from the entropy of the DC and
+        AC symbols plus their amplitude bits, without Huffman coding, plus
+        the side information of the transform. The symbols are only counted,
+        from the non-zero coefficients, without laying them out as in the
+        encoder. The DC symbols are counted on all the blocks, as they code
+        the differences between neighbours, and the AC symbols and the
+        distortion on a sample of sample_blocks blocks if there are more,
+        with their bits scaled to all the blocks.
+
+        Args:
+            image: The image to evaluate
+            factors: The quantization factors to evaluate
+            memory_budget: The maximum size in bytes of the temporary arrays of each batch
+            sample_blocks: The number of blocks to evaluate the AC symbols and the distortion on
+        Returns:
+            A dictionary with the factors and the PSNR (dB) and estimated
+            bits per pixel of each factor
+        """
+        image = self._read_image(image)
+        factors = np.asarray(list(factors))
+
+        image_key = curve_key = None
+        if self.coefficient_cache.budget:
+            image_key = array_hash(image)
+            curve_key = ("rd_sweep", self._cache_key(image_key), tuple(factors.tolist()), sample_blocks)
+            curve = self.coefficient_cache.get(curve_key)
+            if curve is not None:
+                return {"factors": factors, "psnr": curve[0], "bpp": curve[1]}
+
+        zig_zag = zig_zag_indices(self.block_size)
+        coefficients = self._coefficients(image, image_key).reshape(-1, self.block_size ** 2)
+        n_blocks = len(coefficients)
+        DC = coefficients[:, 0].astype(np.float32)
+        if n_blocks > sample_blocks:
+            # A random block of each group of step blocks, as evenly spaced
+            # blocks can alias with periodic content like lines of text
+            step = -(-n_blocks // sample_blocks)
+            starts = np.arange(0, n_blocks, step)
+            offsets = np.random.default_rng(0).integers(0, step, len(starts))
+            coefficients = coefficients[np.minimum(starts + offsets, n_blocks - 1)]
+        coefficients = coefficients[:, zig_zag].astype(np.float32, copy=False)
+        n_sampled, n_coefficients = coefficients.shape
+
+        psnr, bits = [], []
+        batch_size = max(1, memory_budget // (3 * coefficients.nbytes))
+        for start in range(0, len(factors), batch_size):
+            batch = factors[start:start + batch_size]
+            steps = np.array([self._quantization_matrix(factor).ravel()[zig_zag] for factor in batch], dtype=np.float32)
+            quantized = np.multiply(coefficients, 1 / steps[:, None, :])
+            np.rint(quantized, out=quantized)
+
+            error = quantized * steps[:, None, :]
+            error -= coefficients
+            mse = np.einsum('fnk,fnk->f', error, error, dtype=np.float64) / error[0].size
+            with np.errstate(divide='ignore'):
+                psnr.append(10 * np.log10(255 ** 2 / mse))
+            del error
+
+            DC_diffs = np.diff(np.rint(DC * (1 / steps[:, :1])).astype(np.int16), axis=1, prepend=0)
+            DC_sizes = bit_lengths(DC_diffs).astype(np.intp)
+            DC_counts = np.bincount((np.arange(len(batch))[:, None] * 32 + DC_sizes).ravel(), minlength=32 * len(batch))
+
+            # The (run length, size) symbol of each non-zero AC coefficient,
+            # a (15, 0) for every 16 zeros of its run and the End of Block
+            # (0, 0) of each block that ends with zeros
+            non_zero = quantized != 0
+            non_zero[:, :, 0] = False
+            indexes = np.flatnonzero(non_zero)
+            del non_zero
+            sizes = bit_lengths(quantized.ravel()[indexes].astype(np.int16)).astype(np.intp)
+            block_indexes, positions = np.divmod(indexes, n_coefficients)
+            factor_indexes = block_indexes // n_sampled
+            first_in_block = np.ones(len(positions), dtype=bool)
+            first_in_block[1:] = block_indexes[1:] != block_indexes[:-1]
+            previous_positions = np.empty_like(positions)
+            previous_positions[1:] = positions[:-1]
+            previous_positions[first_in_block] = 0
+            run_lengths = positions - previous_positions - 1
+            AC_counts = np.bincount(factor_indexes * 512 + run_lengths % 16 * 32 + sizes, minlength=512 * len(batch))
+            AC_counts = AC_counts.reshape(len(batch), -1)
+            AC_counts[:, 15 * 32] += np.bincount(factor_indexes, weights=run_lengths // 16, minlength=len(batch)).astype(np.intp)
+            last_positions = np.zeros(len(batch) * n_sampled, dtype=np.intp)
+            last_positions[block_indexes] = positions
+            AC_counts[:, 0] += np.count_nonzero(last_positions.reshape(len(batch), -1) < n_coefficients - 1, axis=1)
+            AC_bits = self._entropy_bits(AC_counts) + np.bincount(factor_indexes, weights=sizes, minlength=len(batch))
+            # The AC bits of the sampled blocks are scaled to all the blocks
+            bits.append(
+                self._entropy_bits(DC_counts.reshape(len(batch), -1))
+                + DC_sizes.sum(axis=1)
+                + AC_bits * (n_blocks / n_sampled)
+            )
+            self._notify("rate-distortion")
+
+        curve = np.stack([
+            np.concatenate(psnr),
+            (np.concatenate(bits) + 8 * self.side_information()) / (image.shape[0] * image.shape[1]),
+        ])
+        if curve_key is not None:
+            self.coefficient_cache.put(curve_key, curve)
+        return {"factors": factors, "psnr": curve[0], "bpp": curve[1]}
 
-    def _save_image(self, blocks, filename):
+    def _entropy_bits(self, counts):
         """
-        Save the image to the specified filename
+        Calculate the number of bits needed to code symbols with an ideal
+        entropy coder
+
+        Args:
+            counts: A (n, n_symbols) array with the count of each symbol in n distributions
+        Returns:
+            The number of bits of each distribution
+        """
+        totals = counts.sum(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bits = np.where(counts > 0, counts * np.log2(totals / counts), 0)
+        return bits.sum(axis=1)
+
+    @profiled
+    def decode(self, source, out=None):
+        """
+        Decode a baseline grayscale JPEG file, like the ones written when
+        compressing an image to a file. The coefficients of all the blocks
+        are decoded first and then unquantized and inverse transformed at once.
+
+        Args:
+            source: The path of the file, its content as a bytes-like object
+                    or a binary file-like object to read it from
+            out: A uint8 array of the image shape to reuse for the decoded image
+        Returns:
+            The decoded image
+        """
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                source = f.read()
+        elif hasattr(source, 'read'):
+            source = source.read()
+        data = bytes(source)
+        self._notify("read")
+
+        headers = self._parse_headers(data)
+        height, width = headers["shape"]
+        block_size = len(self.quantization_table)
+        rows, cols = -(-height // block_size), -(-width // block_size)
+        n_blocks = rows * cols
+
+        # The scan ends at the first marker that is not a restart marker
+        scan_start = headers["scan_start"]
+        scan_end = re.compile(rb'\xff[^\x00\xd0-\xd7]').search(data, scan_start)
+        scan = data[scan_start:scan_end.start() if scan_end else len(data)]
+        segments = re.split(rb'\xff[\xd0-\xd7]', scan)
+        restart_interval = headers["restart_interval"] or n_blocks
+        n_segments = -(-n_blocks // restart_interval)
+        if len(segments) < n_segments:
+            raise ValueError("Truncated or corrupt JPEG file")
+
+        dc_table, ac_table = headers["huffman_tables"]
+        coefficients = np.concatenate([
+            decode_scan(segment, dc_table, ac_table, min(restart_interval, n_blocks - i * restart_interval))
+            for i, segment in enumerate(segments[:n_segments])
+        ])
+        self._notify("entropy decoding")
+
+        zig_zag = zig_zag_indices(block_size)
+        blocks = np.empty((n_blocks, block_size ** 2), dtype=np.int16 if self.precision == "Single" else np.float64)
+        blocks[:, zig_zag] = coefficients
+        self._notify("inverse zig-zag")
+
+        # JPEG files are always DCT coded, whatever the selected transform
+        return self._reconstruct_image(
+            blocks.reshape(rows, cols, block_size, block_size), (height, width), out, headers["quantization_table"],
+            self.transforms["DCT"]
+        )
+
+    def _parse_headers(self, data):
+        """
+        Parse the marker segments of a JPEG file up to the start of scan
+
+        Args:
+            data: The content of the file
+        Returns:
+            A dictionary with the image shape, the quantization table, the
+            DC and AC Huffman tables, the restart interval and the position
+            where the scan data starts
+        """
+        try:
+            return self._parse_segments(data)
+        except (st.error, IndexError, KeyError) as e:
+            # The segments or the tables they refer to are cut short or missing
+            raise ValueError("Truncated or corrupt JPEG file") from e
+
+    def _parse_segments(self, data):
+        """
+        Parse the marker segments of a JPEG file up to the start of scan,
+        without checking that the file is complete
+
+        Args:
+            data: The content of the file
+        Returns:
+            The headers, as returned by _parse_headers
+        """
+        markers = {marker: name for name, marker in self.jpeg_markers.items()}
+        if st.unpack_from('>H', data)[0] != self.jpeg_markers["SOI"]:
+            raise ValueError("Not a JPEG file")
+
+        quantization_tables, huffman_tables = {}, {}
+        headers = {"restart_interval": 0}
+        position = 2
+        while True:
+            marker, length = st.unpack_from('>HH', data, position)
+            segment = data[position + 4:position + 2 + length]
+            position += 2 + length
+            name = markers.get(marker)
+
+            if name == "DQT":
+                while segment:
+                    precision, table_id = segment[0] >> 4, segment[0] & 15
+                    n_bytes = 64 * (precision + 1)
+                    values = np.frombuffer(segment[1:1 + n_bytes], dtype='>u2' if precision else np.uint8)
+                    if len(values) < 64:
+                        raise ValueError("Truncated or corrupt JPEG file")
+                    table = np.empty(64)
+                    table[zig_zag_indices(8)] = values
+                    quantization_tables[table_id] = table.reshape(8, 8)
+                    segment = segment[1 + n_bytes:]
+            elif name == "SOF0":
+                _, height, width, n_components = st.unpack_from('>BHHB', segment)
+                if n_components != 1:
+                    raise ValueError("Only grayscale JPEG files can be decoded")
+                headers["shape"] = (height, width)
+                quantization_table_id = segment[8]
+            elif name == "DHT":
+                while segment:
+                    table_class, table_id = segment[0] >> 4, segment[0] & 15
+                    bits = segment[1:17]
+                    huffman_tables[(table_class, table_id)] = HuffmanTable(bits, segment[17:17 + sum(bits)])
+                    segment = segment[17 + sum(bits):]
+            elif name == "DRI":
+                headers["restart_interval"] = st.unpack_from('>H', segment)[0]
+            elif name == "SOS":
+                table_ids = segment[2]
+                headers["huffman_tables"] = (huffman_tables[(0, table_ids >> 4)], huffman_tables[(1, table_ids & 15)])
+                headers["quantization_table"] = quantization_tables[quantization_table_id]
+                headers["scan_start"] = position
+                return headers
+            elif 0xFFC1 <= marker <= 0xFFCF and marker not in (0xFFC4, 0xFFC8, 0xFFCC):
+                raise ValueError("Only baseline JPEG files can be decoded")
+
+    def _save_image(self, blocks, filename, image_shape=None):
+        """
+        Save the image to the specified filename as a baseline JFIF file
+
+        Args:
+            blocks: The quantized blocks
+            filename: The path, writable binary stream or preallocated
+                      writable buffer to save the image to
+            image_shape: The shape of the original image, defaults to the size of the blocks
+        Returns:
+            The size in bytes of the saved image
         """
         if not self.is_standard():
-            raise ValueError("Cannot save image when the block size is not 8x8")
+            raise ValueError("Cannot save image when the blocks are not 8x8 DCT blocks")
 
-        encoded_blocks = self._encode_values(blocks)
-        binary_data = self._huffman_encode(encoded_blocks)
-        with open(filename, 'wb') as f:
-            f.write(st.pack('H', len(binary_data)))
+        if image_shape is None:
+            image_shape = (blocks.shape[0] * self.block_size, blocks.shape[1] * self.block_size)
+
+        huffman_tables = self._huffman_tables(self._encode_values(blocks))
+        binary_data = self._huffman_encode(self._encode_values(blocks), huffman_tables)
+        with OutputStream(filename) as f:
+            f.write(self._headers(image_shape[0], image_shape[1], huffman_tables))
             f.write(binary_data)
+            f.write(st.pack('>H', self.jpeg_markers["EOI"]))
+        self._notify("write")
+        return f.size
+
+    def _save_image_intervals(self, image, filename, transformed_blocks=None):
+        """
+        Save the image as a baseline JFIF file split in restart intervals.
+        Each interval covers a band of rows of blocks and is transformed,
+        quantized and entropy coded independently (the DC prediction is
+        reset at each RSTn marker), in a pool of worker processes that read
+        the image from shared memory. Without a pool the intervals are
+        quantized from the transformed blocks if they are given.
+
+        Args:
+            image: The image to compress
+            filename: The path, writable binary stream or preallocated
+                      writable buffer to save the image to
+            transformed_blocks: The read-only transformed blocks of the image, if they are already known
+        Returns:
+            The size in bytes of the saved image
+        """
+        if not self.is_standard():
+            raise ValueError("Cannot save image when the blocks are not 8x8 DCT blocks")
+
+        height, width = image.shape
+        rows, cols = -(-height // self.block_size), -(-width // self.block_size)
+        interval_rows = self._interval_rows(rows, cols)
+        intervals = [(row, min(row + interval_rows, rows)) for row in range(0, rows, interval_rows)]
+
+        # The workers transform their own intervals instead of receiving the blocks
+        if self.workers > 1:
+            transformed_blocks = None
+
+        huffman_tables = self.huffman_tables
+        if self.optimize_huffman:
+            frequencies = sum(self._map_intervals(image, "_interval_frequencies", intervals, transformed_blocks))
+            huffman_tables = [optimal_huffman_table(table_frequencies) for table_frequencies in frequencies]
+        segments = self._map_intervals(image, "_encode_interval", intervals, huffman_tables, transformed_blocks)
+
+        with OutputStream(filename) as f:
+            f.write(self._headers(height, width, huffman_tables, interval_rows * cols))
+            for i, segment in enumerate(segments):
+                if i:
+                    f.write(st.pack('>H', self.jpeg_markers["RST0"] + (i - 1) % 8))
+                f.write(segment)
+            f.write(st.pack('>H', self.jpeg_markers["EOI"]))
+        self._notify("write")
+        return f.size
+
+    def _interval_rows(self, rows, cols):
+        """
+        Get the number of rows of blocks of each restart interval
+
+        Args:
+            rows: The number of rows of blocks of the image
+            cols: The number of columns of blocks of the image
+        Returns:
+            The number of rows of blocks of each interval
+        """
+        interval_rows = self.restart_rows or -(-rows // (4 * self.workers))
+        # The restart interval is stored in 16 bits
+        return max(1, min(interval_rows, 0xFFFF // cols))
+
+    def _map_intervals(self, image, method, intervals, *args):
+        """
+        Call a method for each interval of rows of blocks, in the worker
+        processes if there is more than one worker
+
+        Args:
+            image: The image to compress
+            method: The name of the method, called as method(image, first_row, last_row, *args)
+            intervals: The (first_row, last_row) of each interval
+            *args: Extra arguments for the method
+        Returns:
+            The results of the method, in the order of the intervals
+        """
+        if self.workers <= 1:
+            return [getattr(self, method)(image, *interval, *args) for interval in intervals]
+
+        # The workers use the factor already searched for the targets
+        configuration = dict(self.configuration, target_bytes=None, target_psnr=None)
+        configuration["Quantization Factor"] = self.quantization_factor
+
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        memory = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        try:
+            np.ndarray(image.shape, dtype=np.uint8, buffer=memory.buf)[:] = image
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_interval_worker,
+                initargs=(configuration, memory.name, image.shape)
+            ) as pool:
+                return list(pool.map(_run_interval, [(method, *interval, *args) for interval in intervals]))
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def _interval_blocks(self, image, first_row, last_row, transformed_blocks=None):
+        """
+        Get the quantized blocks of an interval of rows of blocks
+
+        Args:
+            image: The image to compress
+            first_row: The first row of blocks of the interval
+            last_row: The row of blocks after the last one of the interval
+            transformed_blocks: The read-only transformed blocks of the image,
+                to quantize the interval without transforming it again
+        Returns:
+            The quantized blocks of the interval
+        """
+        if transformed_blocks is not None:
+            return self._quantize_image(image, transformed_blocks[first_row:last_row])
+        band = image[first_row * self.block_size:last_row * self.block_size]
+        blocks = self._create_image_blocks(band, self.block_size)
+        return self._quantize_blocks(self._transform_blocks(blocks))
+
+    def _interval_frequencies(self, image, first_row, last_row, transformed_blocks=None):
+        """
+        Count the DC and AC symbols of an interval of rows of blocks
+
+        Returns:
+            A (2, 256) array with the frequency of each DC and AC symbol
+        """
+        quantized_blocks = self._interval_blocks(image, first_row, last_row, transformed_blocks)
+        return sum(stream.frequencies() for stream in self._encode_values(quantized_blocks))
+
+    def _encode_interval(self, image, first_row, last_row, huffman_tables, transformed_blocks=None):
+        """
+        Entropy code an interval of rows of blocks, starting with a DC
+        prediction of 0 as required after a restart marker
+
+        Returns:
+            The entropy coded bytes of the interval
+        """
+        quantized_blocks = self._interval_blocks(image, first_row, last_row, transformed_blocks)
+        return bytes(self._huffman_encode(self._encode_values(quantized_blocks), huffman_tables))
+
+    def _segment(self, marker, payload):
+        """
+        Build a marker segment
+
+        Args:
+            marker: The name of the marker
+            payload: The content of the segment
+        Returns:
+            The segment bytes
+        """
+        return st.pack('>HH', self.jpeg_markers[marker], len(payload) + 2) + payload
+
+    def _headers(self, height, width, huffman_tables, restart_interval=0):
+        """
+        Build the JFIF headers, from the start of image to the start of scan
+
+        Args:
+            height: The height of the image
+            width: The width of the image
+            huffman_tables: The DC and AC Huffman tables
+            restart_interval: The number of blocks between restart markers, 0 for no restarts
+        Returns:
+            The header bytes
+        """
+        quantization_matrix = np.rint(self._quantization_matrix()).astype(np.uint8)
+        zig_zag_table = quantization_matrix.ravel()[zig_zag_indices(self.block_size)].tobytes()
+
+        headers = st.pack('>H', self.jpeg_markers["SOI"])
+        headers += self._segment("APP0", b'JFIF\0' + st.pack('>BBBHHBB', 1, 1, 0, 1, 1, 0, 0))
+        headers += self._segment("DQT", b'\x00' + zig_zag_table)
+        headers += self._segment("SOF0", st.pack('>BHHBBBB', 8, height, width, 1, 1, 0x11, 0))
+        for table_class, table in enumerate(huffman_tables):
+            headers += self._segment("DHT", st.pack('>B16B', table_class << 4, *table.bits) + bytes(table.values))
+        if restart_interval:
+            headers += self._segment("DRI", st.pack('>H', restart_interval))
+        headers += self._segment("SOS", st.pack('>BBBBBB', 1, 1, 0x00, 0, 63, 0))
+        return headers
     
-    def _encode_values(self, quantized_blocks):
+    def _encode_values(self, quantized_blocks, chunk_blocks=1 << 15, previous_DC=0):
         """
-        Encode the DC and AC coefficients of the image
+        Encode the DC and AC coefficients of the image. The DC coefficients
+        are encoded as the difference with the previous block and the AC
+        coefficients are run-length encoded. The blocks are encoded in chunks
+        of chunk_blocks blocks, so the temporary arrays are bounded.
+
+        Args:
+            quantized_blocks: The quantized blocks
+            chunk_blocks: The number of blocks of each chunk
+            previous_DC: The DC coefficient of the block before the first one
+        Returns:
+            A generator of the SymbolStream of each chunk of blocks
         """
-        previous_DC = 0
-        encoded_values = []
-        for quantized_block in quantized_blocks:
-            zig_zag_block = self._zig_zag_scan(quantized_block)
+        flat_blocks = quantized_blocks.reshape(-1, self.block_size, self.block_size)
+        for start in range(0, len(flat_blocks), chunk_blocks):
+            zig_zag_blocks = self._zig_zag_scan(flat_blocks[start:start + chunk_blocks]).astype(np.int32)
+            # The scan order is the same for every chunk, it is published once
+            self._notify("zig-zag", None if start else self._scan_order)
             # DC encoding
-            DC = zig_zag_block.pop(0)
-            DC_diff = DC - previous_DC
-            DC_symb = (DC_diff, self.bits_required(DC_diff))
+            DC_diffs = np.diff(zig_zag_blocks[:, 0], prepend=previous_DC)
+            previous_DC = zig_zag_blocks[-1, 0]
 
             # AC encoding
-            AC_symb = self._run_length_encode(zig_zag_block)
-
-            # Output the encoded block
-            encoded_values = np.array([DC_symb] + AC_symb)
-            previous_DC = DC
-        return encoded_values
+            stream = SymbolStream.from_symbols(DC_diffs, *self._run_length_encode(zig_zag_blocks[:, 1:]))
+            self._notify("run-length encoding")
+            yield stream
             
-    def _zig_zag_scan(self, block):
+    def _zig_zag_scan(self, blocks):
         """
-        Scan the block in a zig-zag pattern
+        Scan the blocks in a zig-zag pattern
 
         Args:
-            block: The block to scan
+            blocks: The (rows, cols, block_size, block_size) blocks to scan
+        Returns:
+            A (rows * cols, block_size ** 2) array with the scanned blocks
+        """
+        zig_zag = zig_zag_indices(self.block_size)
+        return blocks.reshape(-1, self.block_size ** 2)[:, zig_zag]
+
+    def _scan_order(self):
+        """
+        Get the position of each coefficient of a block in the zig-zag scan
+
         Returns:
-            The scanned block
+            A (block_size, block_size) array with the scan order
         """
-        if self.codification_steps:
-            plot = self.codification_steps[4].get_plot(1, 1, 1)
-            order_array = np.zeros((self.block_size, self.block_size))
-            for key, item in self.zig_zag_order.items():
-                order_array[item[0], item[1]] = key
-            plot.imshow(order_array, cmap='viridis', interpolation='none')
-            for key in self.zig_zag_order.keys():
-                plot.text(self.zig_zag_order[key][1], self.zig_zag_order[key][0], str(key), ha='center', va='center', color='white')
-            self.codification_steps[4].update_plot()
-        return np.array([block[self.zig_zag_order[i]] for i in range(self.block_size ** 2)])
+        order = np.empty(self.block_size ** 2, dtype=np.int64)
+        order[zig_zag_indices(self.block_size)] = np.arange(self.block_size ** 2)
+        return order.reshape(self.block_size, self.block_size)
 
     def bits_required(self, number):
         """
@@ -424,41 +1478,114 @@ class JPEG:
             result += 1
         return result
 
-    def _run_length_encode(self, block):
+    def _run_length_encode(self, blocks):
         """
-        Run-length encode the AC coefficients of the block
+        Run-length encode the AC coefficients of the blocks. Each non-zero
+        coefficient is encoded as (run length, size, amplitude), runs of 16
+        zeros as (15, 0, 0) and the trailing zeros of a block as an End of
+        Block (0, 0, 0).
 
         Args:
-            block: The block to encode
+            blocks: A (n_blocks, n_coefficients) array with the AC coefficients of each block
         Returns:
-            The encoded AC coefficients
+            The block index, run length, size and amplitude of each symbol,
+            sorted by block
         """
-        def int_to_bin(n):
-            if n == 0:
-                return ''
-            ret = bin(n)[2:]
-            return ret if n > 0 else ''.join(['1' if x == '0' else '0' for x in ret])
-        
-        last_non_zero = -1
-        for i, coeff in enumerate(block):
-            if coeff != 0:
-                last_non_zero = i
-        
-        symbols = [] # (runlength, size, value)
-        run_length = 0
-        for i, coeff in enumerate(block):
-            if i <= last_non_zero:
-                # Encode the coefficient
-                if coeff == 0 and run_length < 15:
-                    run_length += 1
-                    continue
-                symbols.append((run_length, self.bits_required(coeff), int_to_bin(coeff)))
-                run_length = 0
-            else:
-                # End of block
-                symbols.append((0, 0, int_to_bin(0)))
-                break
-        return symbols
+        n_blocks, n_coefficients = blocks.shape
+        non_zero_blocks, non_zero_positions = np.nonzero(blocks)
+        amplitudes = blocks[non_zero_blocks, non_zero_positions]
+
+        # Zeros between each coefficient and the previous one of the block
+        first_in_block = np.ones(len(non_zero_blocks), dtype=bool)
+        first_in_block[1:] = non_zero_blocks[1:] != non_zero_blocks[:-1]
+        previous_positions = np.empty_like(non_zero_positions)
+        previous_positions[1:] = non_zero_positions[:-1]
+        previous_positions[first_in_block] = -1
+        run_lengths = non_zero_positions - previous_positions - 1
+
+        # Runs longer than 15 zeros are split using (15, 0, 0) symbols
+        n_symbols = run_lengths // 16 + 1
+        is_coefficient = np.zeros(n_symbols.sum(), dtype=bool)
+        is_coefficient[np.cumsum(n_symbols) - 1] = True
+        symbol_blocks = np.repeat(non_zero_blocks, n_symbols)
+        symbol_runs = np.full(len(symbol_blocks), 15)
+        symbol_runs[is_coefficient] = run_lengths % 16
+        symbol_amplitudes = np.zeros(len(symbol_blocks), dtype=blocks.dtype)
+        symbol_amplitudes[is_coefficient] = amplitudes
+
+        # End of Block for the blocks that do not end with a non-zero coefficient
+        last_positions = np.full(n_blocks, -1)
+        last_positions[non_zero_blocks] = non_zero_positions
+        has_EOB = last_positions < n_coefficients - 1
+        previous_EOBs = np.cumsum(has_EOB) - has_EOB
+        symbol_indexes = np.arange(len(symbol_blocks)) + previous_EOBs[symbol_blocks]
+        counts = np.bincount(symbol_blocks, minlength=n_blocks) + has_EOB
+        EOB_indexes = np.cumsum(counts)[has_EOB] - 1
+
+        total = len(symbol_blocks) + len(EOB_indexes)
+        block_indexes = np.empty(total, dtype=np.int64)
+        run_lengths = np.zeros(total, dtype=np.uint8)
+        sizes = np.zeros(total, dtype=np.uint8)
+        values = np.zeros(total, dtype=blocks.dtype)
+        block_indexes[symbol_indexes] = symbol_blocks
+        block_indexes[EOB_indexes] = np.flatnonzero(has_EOB)
+        run_lengths[symbol_indexes] = symbol_runs
+        values[symbol_indexes] = symbol_amplitudes
+        sizes[symbol_indexes] = bit_lengths(symbol_amplitudes)
+        return block_indexes, run_lengths, sizes, values
+
+    def _huffman_tables(self, encoded_values):
+        """
+        Get the DC and AC Huffman tables to encode the image. If the Huffman
+        optimization is enabled, the tables are built from the frequencies
+        of the symbols of the image, otherwise the standard tables are used.
+
+        Args:
+            encoded_values: The SymbolStreams of the image
+        Returns:
+            The DC and AC Huffman tables
+        """
+        if not self.optimize_huffman:
+            return self.huffman_tables
+
+        frequencies = sum(stream.frequencies() for stream in encoded_values)
+        return [optimal_huffman_table(table_frequencies) for table_frequencies in frequencies]
+
+    def _huffman_encode(self, encoded_values, huffman_tables):
+        """
+        Encode the symbols of the blocks using the Huffman tables
+
+        Args:
+            encoded_values: The SymbolStreams of the image
+            huffman_tables: The DC and AC Huffman tables
+        Returns:
+            The entropy coded scan data
+        """
+        writer = BitWriter()
+        for stream in encoded_values:
+            huffman_encode(writer, huffman_tables, stream)
+            self._notify("entropy coding")
+        writer.flush()
+        return writer.getvalue()
+
+
+# State of the worker processes of the restart interval encoding
+_worker_jpeg = None
+_worker_image = None
+_worker_memory = None
+
+
+def _init_interval_worker(configuration, memory_name, shape):
+    """
+    Create the JPEG instance of a worker process and attach to the shared image
+    """
+    global _worker_jpeg, _worker_image, _worker_memory
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    _worker_jpeg = JPEG()
+    _worker_jpeg.configure(**configuration)
+    _worker_image = np.ndarray(shape, dtype=np.uint8, buffer=_worker_memory.buf)
+
 
-    def _huffman_encode(self, encoded_values):
-        ...
\ No newline at end of file
+def _run_interval(task):
+    method, *args = task
+    return getattr(_worker_jpeg, method)(_worker_image, *args)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from onas.utils.blocks import bit_lengths
+
+
+class SymbolStream:
+    def __init__(self, run_lengths, sizes, amplitudes, offsets):
+        """
+        Entropy symbols of a sequence of blocks, stored as parallel typed
+        arrays. The symbols of block i are in offsets[i]:offsets[i + 1], the
+        first one is the DC symbol (run length 0 and the DC difference as
+        amplitude) and the rest are the AC symbols (ZRL and EOB included).
+
+        Args:
+            run_lengths: The uint8 run length of each symbol
+            sizes: The uint8 number of amplitude bits of each symbol
+            amplitudes: The int16 amplitude of each symbol
+            offsets: The int64 index of the first symbol of each block, plus the total
+        """
+        self.run_lengths = run_lengths
+        self.sizes = sizes
+        self.amplitudes = amplitudes
+        self.offsets = offsets
+
+    @classmethod
+    def from_symbols(cls, DC_diffs, block_indexes, run_lengths, sizes, amplitudes):
+        """
+        Interleave the DC differences with the AC symbols of the blocks
+
+        Args:
+            DC_diffs: The DC difference of each block
+            block_indexes: The block of each AC symbol, sorted
+            run_lengths: The run length of each AC symbol
+            sizes: The size of each AC symbol
+            amplitudes: The amplitude of each AC symbol
+        Returns:
+            The SymbolStream of the blocks
+        """
+        n_blocks = len(DC_diffs)
+        offsets = np.empty(n_blocks + 1, dtype=np.int64)
+        offsets[:-1] = np.arange(n_blocks) + np.searchsorted(block_indexes, np.arange(n_blocks))
+        offsets[-1] = n_blocks + len(block_indexes)
+        AC_indexes = np.arange(len(block_indexes)) + block_indexes + 1
+
+        stream = cls(
+            np.zeros(offsets[-1], dtype=np.uint8),
+            np.empty(offsets[-1], dtype=np.uint8),
+            np.empty(offsets[-1], dtype=np.int16),
+            offsets
+        )
+        stream.sizes[offsets[:-1]] = bit_lengths(DC_diffs)
+        stream.amplitudes[offsets[:-1]] = DC_diffs
+        stream.run_lengths[AC_indexes] = run_lengths
+        stream.sizes[AC_indexes] = sizes
+        stream.amplitudes[AC_indexes] = amplitudes
+        return stream
+
+    def __len__(self):
+        return len(self.run_lengths)
+
+    def symbols(self):
+        """
+        Get the Huffman symbol of each entry: the size for the DC symbols and
+        the run length in the high nibble and the size in the low nibble for
+        the AC symbols (the run length of the DC symbols is always 0)
+
+        Returns:
+            The uint8 symbols
+        """
+        return (self.run_lengths << 4) | self.sizes
+
+    def table_indexes(self):
+        """
+        Get the Huffman table of each symbol, 0 for DC and 1 for AC
+
+        Returns:
+            The uint8 table indexes
+        """
+        table_indexes = np.ones(len(self), dtype=np.uint8)
+        table_indexes[self.offsets[:-1]] = 0
+        return table_indexes
+
+    def frequencies(self):
+        """
+        Count the DC and AC symbols
+
+        Returns:
+            A (2, 256) array with the frequency of each DC and AC symbol
+        """
+        counts = np.bincount(self.table_indexes().astype(np.intp) * 256 + self.symbols(), minlength=512)
+        return counts.reshape(2, 256)
@@ -0,0 +1,432 @@
+import functools
+import numpy as np
+
+from onas.utils.cache import LRUCache
+
+
+def float_dtype(array):
+    """
+    Get the float type the transforms of an array are computed in: float32
+    arrays stay in float32 and the rest are computed in float64
+    """
+    return np.result_type(array.dtype, np.float32)
+
+
+@functools.lru_cache(maxsize=None)
+def dct_matrix(block_size, dtype=np.float64):
+    """
+    Compute the orthonormal DCT-II basis matrix for the block size. The
+    matrix is cached, so it is only built once per block size and type.
+
+    Args:
+        block_size: The size of the blocks
+        dtype: The float type of the matrix
+    Returns:
+        A read-only (block_size, block_size) matrix C such that C @ X @ C.T
+        is the 2D DCT of the block X
+    """
+    n = np.arange(block_size)
+    basis = np.cos((2 * n[None, :] + 1) * n[:, None] * np.pi / (2 * block_size))
+    basis *= np.sqrt(2 / block_size)
+    basis[0] /= np.sqrt(2)
+    basis = basis.astype(dtype)
+    basis.flags.writeable = False
+    return basis
+
+
+def matrix_dct(blocks):
+    """
+    Apply the 2D DCT to a stack of blocks using the cached basis matrix
+
+    Args:
+        blocks: A (..., block_size, block_size) array of blocks
+    Returns:
+        The transformed blocks
+    """
+    basis = dct_matrix(blocks.shape[-1], float_dtype(blocks))
+    return basis @ blocks @ basis.T
+
+
+def matrix_idct(blocks):
+    """
+    Apply the 2D inverse DCT to a stack of blocks using the cached basis matrix
+
+    Args:
+        blocks: A (..., block_size, block_size) array of transformed blocks
+    Returns:
+        The untransformed blocks
+    """
+    basis = dct_matrix(blocks.shape[-1], float_dtype(blocks))
+    return basis.T @ blocks @ basis
+
+
+def scipy_dct(blocks):
+    """
+    Apply the 2D DCT to a stack of blocks using SciPy. SciPy is imported on
+    the first call, as it is the slowest import of the codec.
+
+    Args:
+        blocks: A (..., block_size, block_size) array of blocks
+    Returns:
+        The transformed blocks
+    """
+    from scipy.fftpack import dct
+    return dct(dct(blocks, axis=-2, norm='ortho'), axis=-1, norm='ortho')
+
+
+def scipy_idct(blocks):
+    """
+    Apply the 2D inverse DCT to a stack of blocks using SciPy
+
+    Args:
+        blocks: A (..., block_size, block_size) array of transformed blocks
+    Returns:
+        The untransformed blocks
+    """
+    from scipy.fftpack import idct
+    return idct(idct(blocks, axis=-2, norm='ortho'), axis=-1, norm='ortho')
+
+
+# Fixed-point precision of the integer transforms, the same as the islow DCT of libjpeg
+CONST_BITS = 13
+PASS1_BITS = 2
+
+# The constants of the LLM butterflies in CONST_BITS fixed point
+FIX_0_298631336 = 2446
+FIX_0_390180644 = 3196
+FIX_0_541196100 = 4433
+FIX_0_765366865 = 6270
+FIX_0_899976223 = 7373
+FIX_1_175875602 = 9633
+FIX_1_501321110 = 12299
+FIX_1_847759065 = 15137
+FIX_1_961570560 = 16069
+FIX_2_053119869 = 16819
+FIX_2_562915447 = 20995
+FIX_3_072711026 = 25172
+
+
+@functools.lru_cache(maxsize=None)
+def fixed_point_dct_matrix(block_size):
+    """
+    Get the DCT basis matrix of the block size rounded to CONST_BITS fixed
+    point. The matrix is cached and read-only.
+
+    Args:
+        block_size: The size of the blocks
+    Returns:
+        A (block_size, block_size) float matrix of integer values
+    """
+    basis = np.round(dct_matrix(block_size) * (1 << CONST_BITS))
+    basis.flags.writeable = False
+    return basis
+
+
+def _descale(values, bits):
+    """
+    Divide integer values by 2 ** bits rounding to the nearest integer, like
+    the DESCALE macro of libjpeg
+    """
+    if values.dtype.kind == 'f':
+        values += 1 << (bits - 1)
+        values /= 1 << bits
+        return np.floor(values, out=values)
+    values += 1 << (bits - 1)
+    values >>= bits
+    return values
+
+
+def _llm_forward(d, bits):
+    """
+    One dimensional 8-point DCT with the butterflies of Loeffler, Ligtenberg
+    and Moschytz, as in jfdctint.c. The outputs are computed in CONST_BITS
+    fixed point and descaled by the given bits.
+
+    Args:
+        d: An (8, ...) integer array, the points are along the first axis
+        bits: The bits to descale the outputs
+    Returns:
+        The (8, ...) transformed points
+    """
+    tmp0, tmp7 = d[0] + d[7], d[0] - d[7]
+    tmp1, tmp6 = d[1] + d[6], d[1] - d[6]
+    tmp2, tmp5 = d[2] + d[5], d[2] - d[5]
+    tmp3, tmp4 = d[3] + d[4], d[3] - d[4]
+
+    # Even part
+    tmp10, tmp13 = tmp0 + tmp3, tmp0 - tmp3
+    tmp11, tmp12 = tmp1 + tmp2, tmp1 - tmp2
+    z1 = (tmp12 + tmp13) * FIX_0_541196100
+    out = [None] * 8
+    out[0] = (tmp10 + tmp11) << CONST_BITS
+    out[4] = (tmp10 - tmp11) << CONST_BITS
+    out[2] = z1 + tmp13 * FIX_0_765366865
+    out[6] = z1 - tmp12 * FIX_1_847759065
+
+    # Odd part
+    z1, z2 = tmp4 + tmp7, tmp5 + tmp6
+    z3, z4 = tmp4 + tmp6, tmp5 + tmp7
+    z5 = (z3 + z4) * FIX_1_175875602
+    z1 *= -FIX_0_899976223
+    z2 *= -FIX_2_562915447
+    z3 = z3 * -FIX_1_961570560 + z5
+    z4 = z4 * -FIX_0_390180644 + z5
+    out[7] = tmp4 * FIX_0_298631336 + z1 + z3
+    out[5] = tmp5 * FIX_2_053119869 + z2 + z4
+    out[3] = tmp6 * FIX_3_072711026 + z2 + z3
+    out[1] = tmp7 * FIX_1_501321110 + z1 + z4
+
+    return np.stack([_descale(value, bits) for value in out])
+
+
+def _llm_inverse(d, bits):
+    """
+    One dimensional 8-point inverse DCT with the butterflies of Loeffler,
+    Ligtenberg and Moschytz, as in jidctint.c
+
+    Args:
+        d: An (8, ...) integer array, the points are along the first axis
+        bits: The bits to descale the outputs
+    Returns:
+        The (8, ...) untransformed points
+    """
+    # Even part
+    z1 = (d[2] + d[6]) * FIX_0_541196100
+    tmp2 = z1 - d[6] * FIX_1_847759065
+    tmp3 = z1 + d[2] * FIX_0_765366865
+    tmp0 = (d[0] + d[4]) << CONST_BITS
+    tmp1 = (d[0] - d[4]) << CONST_BITS
+    tmp10, tmp13 = tmp0 + tmp3, tmp0 - tmp3
+    tmp11, tmp12 = tmp1 + tmp2, tmp1 - tmp2
+
+    # Odd part
+    z1, z2 = d[7] + d[1], d[5] + d[3]
+    z3, z4 = d[7] + d[3], d[5] + d[1]
+    z5 = (z3 + z4) * FIX_1_175875602
+    z1 *= -FIX_0_899976223
+    z2 *= -FIX_2_562915447
+    z3 = z3 * -FIX_1_961570560 + z5
+    z4 = z4 * -FIX_0_390180644 + z5
+    tmp0 = d[7] * FIX_0_298631336 + z1 + z3
+    tmp1 = d[5] * FIX_2_053119869 + z2 + z4
+    tmp2 = d[3] * FIX_3_072711026 + z2 + z3
+    tmp3 = d[1] * FIX_1_501321110 + z1 + z4
+
+    out = [tmp10 + tmp3, tmp11 + tmp2, tmp12 + tmp1, tmp13 + tmp0,
+           tmp13 - tmp0, tmp12 - tmp1, tmp11 - tmp2, tmp10 - tmp3]
+    return np.stack([_descale(value, bits) for value in out])
+
+
+def integer_dct(blocks):
+    """
+    Apply the 2D DCT to a stack of blocks in fixed-point integer arithmetic.
+    The input is rounded to integers and so are the coefficients, which are
+    the same on every platform.
+
+    8x8 blocks use the LLM butterflies of the islow DCT of libjpeg, without
+    its final scaling by 8. Other block sizes multiply by the basis matrix
+    rounded to fixed point. The products are done with floats holding
+    integer values, which are exact as they stay far below 2 ** 53.
+
+    Args:
+        blocks: A (..., block_size, block_size) array of blocks
+    Returns:
+        The float transformed blocks, with integer values
+    """
+    block_size = blocks.shape[-1]
+    if block_size == 8:
+        # Work on (8, 8, n) arrays so the points of each butterfly are contiguous
+        points = np.moveaxis(np.rint(blocks).astype(np.int32), (-2, -1), (0, 1))
+        rows = _llm_forward(points.swapaxes(0, 1), CONST_BITS - PASS1_BITS).swapaxes(0, 1)
+        coefficients = _llm_forward(rows, CONST_BITS + PASS1_BITS + 3)
+        return np.moveaxis(coefficients, (0, 1), (-2, -1)).astype(float_dtype(blocks))
+
+    # The products need float64 to be exact
+    basis = fixed_point_dct_matrix(block_size)
+    rows = _descale(np.rint(blocks) @ basis.T, CONST_BITS - PASS1_BITS)
+    return _descale(basis @ rows, CONST_BITS + PASS1_BITS).astype(float_dtype(blocks), copy=False)
+
+
+def integer_idct(blocks):
+    """
+    Apply the 2D inverse DCT to a stack of blocks in fixed-point integer
+    arithmetic, the inverse of integer_dct
+
+    Args:
+        blocks: A (..., block_size, block_size) array of transformed blocks
+    Returns:
+        The float untransformed blocks, with integer values
+    """
+    block_size = blocks.shape[-1]
+    if block_size == 8:
+        coefficients = np.moveaxis(np.rint(blocks).astype(np.int32), (-2, -1), (0, 1))
+        columns = _llm_inverse(coefficients, CONST_BITS - PASS1_BITS)
+        points = _llm_inverse(columns.swapaxes(0, 1), CONST_BITS + PASS1_BITS + 3).swapaxes(0, 1)
+        return np.moveaxis(points, (0, 1), (-2, -1)).astype(float_dtype(blocks))
+
+    basis = fixed_point_dct_matrix(block_size)
+    columns = _descale(basis.T @ np.rint(blocks), CONST_BITS - PASS1_BITS)
+    return _descale(columns @ basis, CONST_BITS + PASS1_BITS).astype(float_dtype(blocks), copy=False)
+
+
+# The forward and inverse functions of each DCT implementation
+DCT_IMPLEMENTATIONS = {
+    "SciPy": (scipy_dct, scipy_idct),
+    "Matrix": (matrix_dct, matrix_idct),
+    "Integer": (integer_dct, integer_idct),
+}
+
+
+class Transform:
+    """
+    Base of the transform engines of the codecs. An engine transforms a
+    whole (..., block_size, block_size) tensor of blocks at once, and can
+    be fitted to the blocks of an image before transforming them when its
+    basis depends on the image. All the engines are orthonormal, so the
+    distortion can be measured on the coefficients.
+    """
+    # Whether the engine must be fitted to the blocks of each image
+    adaptive = False
+
+    def fit(self, blocks, key=None):
+        """
+        Prepare the engine to transform the blocks of an image
+
+        Args:
+            blocks: The (..., block_size, block_size) level shifted blocks of the image
+            key: A key that identifies the image, to reuse what was fitted before
+        """
+
+    def forward(self, blocks):
+        raise NotImplementedError
+
+    def inverse(self, blocks):
+        raise NotImplementedError
+
+    def side_information(self, block_size) -> int:
+        """
+        Get the bytes the decoder needs besides the coefficients to invert
+        the transform, like an adaptive basis
+
+        Args:
+            block_size: The size of the blocks
+        Returns:
+            The size of the side information in bytes
+        """
+        return 0
+
+
+class DCTTransform(Transform):
+    def __init__(self, implementation="SciPy"):
+        """
+        The 2D Discrete Cosine Transform, with a fixed basis
+
+        Args:
+            implementation: The name of the implementation in DCT_IMPLEMENTATIONS
+        """
+        self.implementation = implementation
+
+    def forward(self, blocks):
+        return DCT_IMPLEMENTATIONS[self.implementation][0](blocks)
+
+    def inverse(self, blocks):
+        return DCT_IMPLEMENTATIONS[self.implementation][1](blocks)
+
+
+class KLTTransform(Transform):
+    adaptive = True
+
+    def __init__(self, cache_budget=16 * 2 ** 20):
+        """
+        The separable Karhunen-Loeve Transform. The basis of the rows is the
+        eigenbasis of the correlation matrix of all the rows of all the
+        blocks, and the same for the columns, so it decorrelates the
+        coefficients of the image along each axis. The bases are stored in
+        float32 as side information and cached per image.
+
+        Args:
+            cache_budget: The maximum size of the cached bases, in bytes
+        """
+        self.bases = LRUCache(cache_budget)
+        self.basis = None
+
+    def fit(self, blocks, key=None):
+        if key is not None:
+            self.basis = self.bases.get(key)
+            if self.basis is not None:
+                return
+
+        block_size = blocks.shape[-1]
+        flat_blocks = blocks.reshape(-1, block_size, block_size)
+        # The correlation of the columns of the rows and of the rows of the columns
+        row_correlation = np.tensordot(flat_blocks, flat_blocks, axes=([0, 1], [0, 1]))
+        column_correlation = np.tensordot(flat_blocks, flat_blocks, axes=([0, 2], [0, 2]))
+
+        bases = []
+        for correlation in (column_correlation, row_correlation):
+            # The eigenvectors by decreasing variance, with their biggest entry positive
+            _, eigenvectors = np.linalg.eigh(correlation)
+            eigenvectors = eigenvectors[:, ::-1]
+            peaks = eigenvectors[np.abs(eigenvectors).argmax(axis=0), np.arange(block_size)]
+            eigenvectors = eigenvectors * np.where(peaks < 0, -1, 1)
+            bases.append(eigenvectors.astype(np.float32).astype(np.float64))
+        self.basis = np.stack(bases)
+        if key is not None:
+            self.bases.put(key, self.basis)
+
+    def forward(self, blocks):
+        if self.basis is None:
+            raise ValueError("The KLT must be fitted to the image before transforming it")
+        column_basis, row_basis = self.basis.astype(float_dtype(blocks), copy=False)
+        return column_basis.T @ blocks @ row_basis
+
+    def inverse(self, blocks):
+        if self.basis is None:
+            raise ValueError("The KLT must be fitted to the image before transforming it")
+        column_basis, row_basis = self.basis.astype(float_dtype(blocks), copy=False)
+        return column_basis @ blocks @ row_basis.T
+
+    def side_information(self, block_size) -> int:
+        return 2 * block_size ** 2 * np.dtype(np.float32).itemsize
+
+
+class FFTTransform(Transform):
+    """
+    The separable real Fourier transform. The spectrum of each row and
+    column is packed as [Re 0, Re 1, Im 1, Re 2, Im 2, ..., Re n/2] and
+    scaled so the transform is orthonormal, which keeps the coefficients
+    real and roughly ordered by frequency like the ones of the DCT.
+    """
+
+    def forward(self, blocks):
+        return _packed_rfft(_packed_rfft(blocks).swapaxes(-1, -2)).swapaxes(-1, -2)
+
+    def inverse(self, blocks):
+        return _packed_irfft(_packed_irfft(blocks.swapaxes(-1, -2)).swapaxes(-1, -2))
+
+
+def _packed_rfft(values):
+    """
+    Orthonormal real FFT along the last axis, of even length, with the
+    spectrum packed in as many real values
+    """
+    n = values.shape[-1]
+    spectrum = np.fft.rfft(values, axis=-1, norm="ortho")
+    packed = np.empty(values.shape, dtype=float_dtype(values))
+    packed[..., 0] = spectrum[..., 0].real
+    packed[..., 1:n - 1:2] = np.sqrt(2) * spectrum[..., 1:n // 2].real
+    packed[..., 2:n - 1:2] = np.sqrt(2) * spectrum[..., 1:n // 2].imag
+    packed[..., n - 1] = spectrum[..., n // 2].real
+    return packed
+
+
+def _packed_irfft(packed):
+    """
+    Inverse of _packed_rfft
+    """
+    n = packed.shape[-1]
+    spectrum = np.empty(packed.shape[:-1] + (n // 2 + 1,), dtype=np.result_type(packed.dtype, np.complex64))
+    spectrum[..., 0] = packed[..., 0]
+    spectrum[..., 1:n // 2] = (packed[..., 1:n - 1:2] + 1j * packed[..., 2:n - 1:2]) / np.sqrt(2)
+    spectrum[..., n // 2] = packed[..., n - 1]
+    return np.fft.irfft(spectrum, n=n, axis=-1, norm="ortho")
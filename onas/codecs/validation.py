@@ -0,0 +1,182 @@
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from onas.codecs.jpeg import JPEG
+from onas.utils.blocks import tile_image
+from onas.utils.metrics import psnr
+from onas.utils.synthetic import synthetic_image
+
+# DCT implementations compared against SciPy in the accuracy report, the
+# reference one is the double precision matrix product used for validation
+ACCURACY_IMPLEMENTATIONS = ("Reference", "Matrix", "Integer")
+
+# Maximum and RMS error of the coefficients and maximum error of the pixels
+# of each implementation that fail the checks. The floating point ones
+# only differ from SciPy by rounding, the integer one by its fixed point
+ACCURACY_TOLERANCES = {
+    "Reference": (1e-9, 1e-9, 0),
+    "Matrix": (1e-9, 1e-9, 0),
+    "Integer": (4, 0.5, 1),
+}
+
+# Precisions compared in the accuracy report, the PSNR difference of the
+# single precision that fails the checks, the times less peak memory it
+# must use and the size of the images, big enough for the peak to scale with it
+PRECISIONS = ("Double", "Single")
+PRECISION_PSNR_TOLERANCE = 0.05
+PRECISION_MEMORY_RATIO = 1.9
+PRECISION_MEGAPIXELS = 1
+
+# Modules that importing the codec must not load: the GUI ones and SciPy,
+# which is imported on the first transform that uses it
+LAZY_MODULES = ("tkinter", "customtkinter", "matplotlib", "scipy")
+
+# Import time of the codec in milliseconds that fails the checks
+IMPORT_BUDGET = 300
+
+
+def import_check(runs=5):
+    """
+    Measure the time to import the codec in fresh interpreters and check
+    that the import doesn't load the lazy modules
+
+    Args:
+        runs: The number of interpreters, the fastest import is kept
+    Returns:
+        The import time in seconds and the lazy modules loaded
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import onas\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(','.join(module for module in {LAZY_MODULES!r} if module in sys.modules))\n"
+    )
+    times, lazy_modules = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            # The directory of the onas package, so this copy of it is imported
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.splitlines()
+        times.append(float(output[0]))
+        lazy_modules = output[1].split(",") if len(output) > 1 and output[1] else []
+    return min(times), lazy_modules
+
+
+def transform_accuracy(kind, megapixels, block_size, implementation):
+    """
+    Compare a DCT implementation with the SciPy one on a synthetic image,
+    without quantization
+
+    Args:
+        kind: The kind of the image
+        megapixels: The size of the image
+        block_size: The size of the blocks
+        implementation: "Reference" or one of the DCT implementations of the codec
+    Returns:
+        A dictionary with the maximum and RMS error of the coefficients, the
+        maximum error and the fraction of changed pixels of the image after
+        the forward and inverse transforms, and the time of both transforms
+    """
+    image = synthetic_image(kind, megapixels)
+    blocks = tile_image(image, block_size) - 128.0
+    jpeg = JPEG()
+    jpeg.configure(**{"Block Size": str(block_size)})
+    expected = jpeg._dct(blocks)
+
+    reference = implementation == "Reference"
+    if not reference:
+        jpeg.configure(**{"Block Size": str(block_size), "DCT Implementation": implementation})
+    start = time.perf_counter()
+    coefficients = jpeg._dct(blocks, fast_implementation=not reference)
+    pixels = jpeg._inverse_dct(coefficients, fast_implementation=not reference)
+    elapsed = time.perf_counter() - start
+
+    error = coefficients - expected
+    pixel_error = np.abs(np.clip(np.rint(pixels + 128), 0, 255) - (blocks + 128))
+    return {
+        "kind": kind,
+        "megapixels": megapixels,
+        "block_size": block_size,
+        "implementation": implementation,
+        "max_error": float(np.abs(error).max()),
+        "rms_error": float(np.sqrt(np.mean(error ** 2))),
+        "max_pixel_error": float(pixel_error.max()),
+        "changed_pixels": float(np.count_nonzero(pixel_error) / pixel_error.size),
+        "time": elapsed,
+    }
+
+
+def accuracy_failures(result):
+    """
+    Check that the errors of a DCT implementation are within its ACCURACY_TOLERANCES
+
+    Returns:
+        A list with the description of each failed check
+    """
+    failures = []
+    for metric, tolerance in zip(("max_error", "rms_error", "max_pixel_error"), ACCURACY_TOLERANCES[result["implementation"]]):
+        if result[metric] > tolerance:
+            failures.append(f"{metric} {result[metric]:.2e} > {tolerance:g}")
+    return failures
+
+
+def precision_accuracy(kind, megapixels, block_size, factor=1):
+    """
+    Compress a synthetic image in memory with each precision, measuring the
+    PSNR and the peak memory traced during the call
+
+    Args:
+        kind: The kind of the image
+        megapixels: The size of the image
+        block_size: The size of the blocks
+        factor: The quantization factor
+    Returns:
+        A dictionary with the PSNR and peak memory of each precision, and
+        the fraction of pixels that differ between the precisions
+    """
+    image = synthetic_image(kind, megapixels)
+    result = {"kind": kind, "megapixels": megapixels, "block_size": block_size, "factor": factor}
+    reconstructions = []
+    for precision in PRECISIONS:
+        jpeg = JPEG()
+        jpeg.configure(**{
+            "Quantization Factor": factor,
+            "Block Size": str(block_size),
+            "Precision": precision,
+            "profile": "memory",
+            "cache_budget": 0,
+        })
+        reconstructions.append(jpeg(image))
+        result[precision] = {"psnr": psnr(image, reconstructions[-1]), "peak_memory": jpeg.stats.peak_memory}
+    result["changed_pixels"] = float(np.count_nonzero(reconstructions[0] != reconstructions[1]) / image.size)
+    return result
+
+
+def precision_failures(result):
+    """
+    Check that the single precision keeps the PSNR of the double precision
+    and uses PRECISION_MEMORY_RATIO times less peak memory
+
+    Returns:
+        A list with the description of each failed check
+    """
+    double, single = result["Double"], result["Single"]
+    failures = []
+    if abs(single["psnr"] - double["psnr"]) > PRECISION_PSNR_TOLERANCE:
+        failures.append(f"PSNR {double['psnr']} -> {single['psnr']} dB")
+    if single["peak_memory"] * PRECISION_MEMORY_RATIO > double["peak_memory"]:
+        failures.append(
+            f"peak memory {double['peak_memory'] / 2 ** 20:.1f} -> {single['peak_memory'] / 2 ** 20:.1f} MB, "
+            f"less than {PRECISION_MEMORY_RATIO}x lower"
+        )
+    return failures
+
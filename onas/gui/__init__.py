@@ -1,2 +1,10 @@
 from .constants import *
-from .steps import StepsFrame
\ No newline at end of file
+from .worker import BackgroundWorker, Cancelled
+
+
+def __getattr__(name):
+    # StepsFrame needs customtkinter and matplotlib, it is imported on first use
+    if name == "StepsFrame":
+        from .steps import StepsFrame
+        return StepsFrame
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -9,7 +9,7 @@ import numpy as np
 from onas.gui import FG_COLOR, FONT_COLOR, FONT_COLOR, PARAGRAPH_FONT, BG_COLOR
 
 class StepsFrame(ctk.CTkFrame):
-    def __init__(self, name: str, parent, description: str):
+    def __init__(self, name: str, parent, description: str, stage: str=None):
         super().__init__(
             parent, 
             width=708,
@@ -47,6 +47,9 @@ class StepsFrame(ctk.CTkFrame):
         self.fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
         self.canvas = FigureCanvasTkAgg(self.fig, master=self)
         self.canvas.get_tk_widget().place(relx=0.05, rely=0.15)
+        self.stage = stage
+        self.snapshot = None
+        self.dirty = False
     
     def get_plot(self, *args):
         if len(args) == 0:
@@ -55,8 +58,45 @@ class StepsFrame(ctk.CTkFrame):
         return self.fig.add_subplot(*args)
     
     def update_plot(self):
+        self.dirty = True
+
+    def on_stage(self, stage, snapshot):
+        """
+        Stage listener of the codification. It can be called from a
+        background thread, so it only keeps the snapshot of the stage of the
+        step and the plot is rendered later from the main thread by draw_pending.
+        """
+        if stage == self.stage and snapshot is not None:
+            self.snapshot = snapshot
+            self.update_plot()
+
+    def draw_pending(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        if self.snapshot is not None:
+            self.render(self.snapshot)
         self.canvas.draw()
 
+    def render(self, snapshot):
+        """
+        Plot a snapshot: a grid with the blocks of a stack of blocks or a
+        single matrix with its values written on it if it is small
+        """
+        self.fig.clear()
+        if snapshot.ndim == 3:
+            for i, block in enumerate(snapshot[:9]):
+                plot = self.get_plot(3, 3, i + 1)
+                plot.imshow(block, cmap='gray')
+                plot.axis('off')
+            return
+
+        plot = self.get_plot()
+        plot.imshow(snapshot, cmap='viridis', interpolation='none')
+        if max(snapshot.shape) <= 8:
+            for (row, column), value in np.ndenumerate(snapshot):
+                plot.text(column, row, str(value), ha='center', va='center', color='white')
+
     def remove_spaces(self, text: str) -> str:
         return " ".join(text.split())
     
\ No newline at end of file
@@ -0,0 +1,92 @@
+import queue
+import threading
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a job when it has been cancelled
+    """
+
+
+class BackgroundWorker:
+    def __init__(self):
+        """
+        Run jobs one at a time in a background thread, so the GUI doesn't
+        freeze while they run. The callbacks of the jobs are not called from
+        the background thread: they are queued and called by poll, which
+        should be called periodically from the Tk main thread with after().
+        """
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        # The cancel event of each running and queued job and whether it can be superseded
+        self.pending = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, job, on_done=None, on_progress=None, on_error=None, supersede=True):
+        """
+        Queue a job
+
+        Args:
+            job: The function to run, called as job(progress). The job should
+                call progress(stage) when it finishes a stage, which raises
+                Cancelled if the job has been cancelled. progress can be
+                registered as a stage listener of a codification
+            on_done: Called with the result of the job
+            on_progress: Called with the name of each stage
+            on_error: Called with the exception if the job fails
+            supersede: Cancel the running and queued jobs that were also
+                submitted with supersede, and let the next of those cancel
+                this one. Jobs submitted without it, like saving a file, are
+                never superseded
+        """
+        if supersede:
+            self.cancel(superseded_only=True)
+        entry = (threading.Event(), supersede)
+        self.pending.append(entry)
+        self.jobs.put((job, entry, on_done, on_progress, on_error))
+
+    def cancel(self, superseded_only=False):
+        """
+        Cancel the running and queued jobs. The running job stops at its next
+        stage and the events it already queued are discarded.
+
+        Args:
+            superseded_only: Only cancel the jobs submitted with supersede
+        """
+        for cancelled, supersedable in list(self.pending):
+            if supersedable or not superseded_only:
+                cancelled.set()
+
+    def poll(self):
+        """
+        Call the callbacks of the queued events of the jobs that have not
+        been cancelled
+        """
+        while True:
+            try:
+                cancelled, callback, argument = self.events.get_nowait()
+            except queue.Empty:
+                return
+            if callback and not cancelled.is_set():
+                callback(argument)
+
+    def _run(self):
+        while True:
+            job, entry, on_done, on_progress, on_error = self.jobs.get()
+            cancelled = entry[0]
+
+            def progress(stage, snapshot=None):
+                if cancelled.is_set():
+                    raise Cancelled()
+                self.events.put((cancelled, on_progress, stage))
+
+            try:
+                if not cancelled.is_set():
+                    self.events.put((cancelled, on_done, job(progress)))
+            except Cancelled:
+                pass
+            except Exception as e:
+                self.events.put((cancelled, on_error, e))
+            finally:
+                self.pending.remove(entry)
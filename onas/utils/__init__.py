@@ -1 +1,4 @@
-from .metrics import *
\ No newline at end of file
+from .metrics import *
+from .blocks import *
+from .profiling import *
+from .synthetic import *
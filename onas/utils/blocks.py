@@ -0,0 +1,136 @@
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+PADDING_MODES = {
+    "Replicate": "edge",
+    "Mirror": "symmetric",
+}
+
+
+def pad_image(image, block_size, padding="Replicate"):
+    """
+    Pad the image so both dimensions are a multiple of the block size.
+    If the image already fits the grid it is returned untouched (no copy).
+
+    Args:
+        image: The 2D image to pad
+        block_size: The size of the blocks
+        padding: The padding mode, one of PADDING_MODES
+    Returns:
+        The padded image
+    """
+    if padding not in PADDING_MODES:
+        raise ValueError(f"Invalid padding mode: {padding}")
+
+    pad_rows = -image.shape[0] % block_size
+    pad_cols = -image.shape[1] % block_size
+    if pad_rows == 0 and pad_cols == 0:
+        return image
+
+    return np.pad(image, ((0, pad_rows), (0, pad_cols)), mode=PADDING_MODES[padding])
+
+
+def tile_image(image, block_size, padding="Replicate"):
+    """
+    Divide the image into blocks without copying the pixel data. The blocks
+    are returned as a single (rows, cols, block_size, block_size) view of the
+    image built with stride tricks. Partial blocks on the right and bottom
+    edges are completed with padding, which is the only case where the
+    image is copied.
+
+    Args:
+        image: The 2D image to divide into blocks
+        block_size: The size of the blocks
+        padding: The padding mode for partial blocks, one of PADDING_MODES
+    Returns:
+        A read-only (rows, cols, block_size, block_size) view of the image
+    """
+    image = pad_image(np.asarray(image), block_size, padding)
+    rows, cols = image.shape[0] // block_size, image.shape[1] // block_size
+    row_stride, col_stride = image.strides
+
+    return as_strided(
+        image,
+        shape=(rows, cols, block_size, block_size),
+        strides=(row_stride * block_size, col_stride * block_size, row_stride, col_stride),
+        writeable=False
+    )
+
+
+def untile_image(blocks, image_shape=None, out=None):
+    """
+    Merge a (rows, cols, block_size, block_size) tensor of blocks back into
+    an image, removing the padding added by tile_image. The blocks are
+    written in a single pass through a strided view of the output, values
+    are cast to the output dtype.
+
+    Args:
+        blocks: The blocks to merge
+        image_shape: The shape of the original image, defaults to the padded shape
+        out: The array to write the image into, it is allocated if not given
+    Returns:
+        The merged image
+    """
+    rows, cols, block_height, block_width = blocks.shape
+    if out is None:
+        if image_shape is None:
+            image_shape = (rows * block_height, cols * block_width)
+        out = np.empty(image_shape[:2], dtype=blocks.dtype)
+
+    height, width = out.shape
+    full_rows, full_cols = height // block_height, width // block_width
+    row_stride, col_stride = out.strides
+
+    grid = as_strided(
+        out,
+        shape=(full_rows, block_height, full_cols, block_width),
+        strides=(row_stride * block_height, row_stride, col_stride * block_width, col_stride)
+    )
+    np.copyto(grid, blocks[:full_rows, :full_cols].transpose(0, 2, 1, 3), casting='unsafe')
+
+    # Partial blocks on the bottom and right edges
+    remaining_rows = height - full_rows * block_height
+    remaining_cols = width - full_cols * block_width
+    if remaining_rows:
+        strip = blocks[full_rows, :, :remaining_rows].transpose(1, 0, 2).reshape(remaining_rows, -1)
+        np.copyto(out[full_rows * block_height:], strip[:, :width], casting='unsafe')
+    if remaining_cols:
+        strip = blocks[:full_rows, full_cols, :, :remaining_cols].reshape(-1, remaining_cols)
+        np.copyto(out[:full_rows * block_height, full_cols * block_width:], strip, casting='unsafe')
+
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def zig_zag_indices(block_size):
+    """
+    Compute the zig-zag scan order of a block. The anti-diagonals are
+    scanned alternately upwards (even diagonals) and downwards (odd
+    diagonals), starting at the top-left corner.
+
+    Args:
+        block_size: The size of the blocks
+    Returns:
+        A read-only array with the flat index (row * block_size + col) of
+        each position of the zig-zag scan
+    """
+    rows, cols = np.indices((block_size, block_size)).reshape(2, -1)
+    diagonals = rows + cols
+    order = np.lexsort((np.where(diagonals % 2, rows, -rows), diagonals))
+    indices = rows[order] * block_size + cols[order]
+    indices.flags.writeable = False
+    return indices
+
+
+def bit_lengths(values):
+    """
+    Calculate the number of bits required to represent the magnitude of
+    each integer value, 0 for the zeros
+
+    Args:
+        values: The integer values
+    Returns:
+        The number of bits of each value
+    """
+    return np.frexp(np.abs(values))[1].astype(np.uint8)
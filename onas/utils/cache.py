@@ -0,0 +1,86 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def array_hash(array):
+    """
+    Hash the content, shape and dtype of an array
+
+    Args:
+        array: The array to hash
+    Returns:
+        The hexadecimal digest of the array
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+class LRUCache:
+    def __init__(self, budget):
+        """
+        Least recently used cache of arrays limited by the total size of the
+        arrays. The cached arrays are made read-only, as they are shared by
+        every call that hits the cache.
+
+        Args:
+            budget: The maximum size of the cached arrays, in bytes
+        """
+        self.budget = budget
+        self.size = 0
+        self.items = OrderedDict()
+
+    def get(self, key):
+        """
+        Get an array from the cache, marking it as the most recently used
+
+        Args:
+            key: The key of the array
+        Returns:
+            The array or None if it is not in the cache
+        """
+        array = self.items.get(key)
+        if array is not None:
+            self.items.move_to_end(key)
+        return array
+
+    def put(self, key, array):
+        """
+        Add an array to the cache, evicting the least recently used arrays
+        until it fits in the budget. Arrays bigger than the budget are not cached.
+
+        Args:
+            key: The key of the array
+            array: The array to cache
+        """
+        if array.nbytes > self.budget:
+            return
+        if key in self.items:
+            self.size -= self.items.pop(key).nbytes
+
+        array.flags.writeable = False
+        self.items[key] = array
+        self.size += array.nbytes
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used arrays until the cache fits in the budget
+        """
+        while self.size > self.budget:
+            _, array = self.items.popitem(last=False)
+            self.size -= array.nbytes
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
@@ -1,12 +1,226 @@
 import numpy as np
 
+# Stabilizing constants of SSIM for 8-bit images
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Weights of the scales of MS-SSIM, from the finest to the coarsest
+MS_SSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+
+
+def mse(original, coded, chunk_rows=1024):
+    """
+    Calculate the mean squared error between two images, row chunk by row
+    chunk so only a chunk of the difference is in memory at a time
+
+    Args:
+        original: The original image
+        coded: The coded image
+        chunk_rows: The number of rows of each chunk
+    Returns:
+        The mean squared error
+    """
+    total = 0.0
+    for top in range(0, len(original), chunk_rows):
+        difference = np.subtract(original[top:top + chunk_rows], coded[top:top + chunk_rows], dtype=np.float32)
+        total += np.einsum('ij,ij->', difference, difference, dtype=np.float64)
+    return total / np.size(original)
+
+
 def psnr(original, coded):
-    mse = np.mean((original - coded) ** 2)
-    if mse == 0:
+    error = mse(original, coded)
+    if error == 0:
         return float('inf')
-    return round(10 * np.log10(255**2 / mse), 2)
+    return round(10 * np.log10(255**2 / error), 2)
+
+
+def _window_sums(image, window):
+    """
+    Sum the values of every window x window square of the image that fits in
+    it, with a separable running sum over each axis
+
+    Args:
+        image: The 2D image
+        window: The size of the square
+    Returns:
+        A (height - window + 1, width - window + 1) array with the sums
+    """
+    rows = image[:len(image) - window + 1].copy()
+    for i in range(1, window):
+        rows += image[i:len(image) - window + 1 + i]
+    sums = rows[:, :rows.shape[1] - window + 1].copy()
+    for i in range(1, window):
+        sums += rows[:, i:rows.shape[1] - window + 1 + i]
+    return sums
+
+
+def _ssim_sums(original, coded, window=7, chunk_rows=16, dtype=np.float32):
+    """
+    Calculate the SSIM and the contrast-structure term of every window of the
+    images and add them up. The images are processed by small chunks of rows
+    (plus the window - 1 rows they overlap) that stay in the CPU cache, with
+    the local statistics stored in dtype. The window is reduced to the
+    smallest side of images smaller than it, so they have a single window
+    across that side.
+
+    Returns:
+        The sum of the SSIM, the sum of the contrast-structure term and the number of windows
+    """
+    height, width = np.shape(original)[:2]
+    window = min(window, height, width)
+    ssim_sum, cs_sum, count = 0.0, 0.0, 0
+    for top in range(0, height - window + 1, chunk_rows):
+        x = np.asarray(original[top:top + chunk_rows + window - 1], dtype=dtype)
+        y = np.asarray(coded[top:top + chunk_rows + window - 1], dtype=dtype)
+        n = window * window
+        mean_x = _window_sums(x, window) / n
+        mean_y = _window_sums(y, window) / n
+        variance_x = _window_sums(x * x, window) / n - mean_x * mean_x
+        variance_y = _window_sums(y * y, window) / n - mean_y * mean_y
+        covariance = _window_sums(x * y, window) / n - mean_x * mean_y
+
+        cs = (2 * covariance + SSIM_C2) / (variance_x + variance_y + SSIM_C2)
+        luminance = (2 * mean_x * mean_y + SSIM_C1) / (mean_x * mean_x + mean_y * mean_y + SSIM_C1)
+        ssim_sum += np.sum(luminance * cs, dtype=np.float64)
+        cs_sum += np.sum(cs, dtype=np.float64)
+        count += cs.size
+    return ssim_sum, cs_sum, count
+
+
+def ssim(original, coded, window=7, chunk_rows=16, dtype=np.float32):
+    """
+    Calculate the mean structural similarity of two images over uniform
+    windows
+
+    Args:
+        original: The original image
+        coded: The coded image
+        window: The size of the square windows
+        chunk_rows: The number of rows of each chunk
+        dtype: The floating point type of the local statistics
+    Returns:
+        The SSIM, 1 for identical images
+    """
+    ssim_sum, _, count = _ssim_sums(original, coded, window, chunk_rows, dtype)
+    return round(ssim_sum / count, 4)
+
+
+def _downsample(image):
+    """
+    Halve the size of an image averaging 2x2 squares, dropping the last row
+    and column if odd
+    """
+    height, width = len(image) // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) / 4
+
+
+def ms_ssim(original, coded, window=7, chunk_rows=16, dtype=np.float32):
+    """
+    Calculate the multi-scale structural similarity of two images. The
+    contrast-structure term is evaluated at each scale and the full SSIM at
+    the coarsest one. Small images use fewer scales, with the weights of the
+    used scales normalized.
+
+    Args:
+        original: The original image
+        coded: The coded image
+        window: The size of the square windows
+        chunk_rows: The number of rows of each chunk
+        dtype: The floating point type of the local statistics and the downsampled images
+    Returns:
+        The MS-SSIM, 1 for identical images
+    """
+    n_scales = len(MS_SSIM_WEIGHTS)
+    while n_scales > 1 and min(np.shape(original)[:2]) < window * 2 ** (n_scales - 1):
+        n_scales -= 1
+    weights = np.array(MS_SSIM_WEIGHTS[:n_scales])
+    weights /= weights.sum()
+
+    result = 1.0
+    for scale, weight in enumerate(weights):
+        ssim_sum, cs_sum, count = _ssim_sums(original, coded, window, chunk_rows, dtype)
+        value = ssim_sum / count if scale == n_scales - 1 else cs_sum / count
+        result *= max(value, 0) ** weight
+        if scale < n_scales - 1:
+            original = _downsample(np.asarray(original, dtype=dtype))
+            coded = _downsample(np.asarray(coded, dtype=dtype))
+    return round(result, 4)
+
+
+def block_mse_map(original, coded, block_size=8, chunk_rows=1024):
+    """
+    Calculate the mean squared error of each block of the images. The blocks
+    of the right and bottom edges can be smaller than block_size.
+
+    Args:
+        original: The original image
+        coded: The coded image
+        block_size: The size of the blocks
+        chunk_rows: The number of rows of each chunk, rounded up to a multiple of block_size
+    Returns:
+        A (rows, cols) array with the MSE of each block
+    """
+    height, width = np.shape(original)[:2]
+    chunk_rows = -(-chunk_rows // block_size) * block_size
+    columns = np.arange(0, width, block_size)
+    column_sizes = np.diff(columns, append=width)
+
+    rows = []
+    for top in range(0, height, chunk_rows):
+        difference = np.subtract(original[top:top + chunk_rows], coded[top:top + chunk_rows], dtype=np.float32)
+        difference *= difference
+        row_starts = np.arange(0, len(difference), block_size)
+        row_sizes = np.diff(row_starts, append=len(difference))
+        sums = np.add.reduceat(np.add.reduceat(difference, row_starts, axis=0, dtype=np.float64), columns, axis=1)
+        rows.append(sums / np.outer(row_sizes, column_sizes))
+    return np.concatenate(rows)
+
+
+def block_psnr_map(original, coded, block_size=8, chunk_rows=1024):
+    """
+    Calculate the PSNR of each block of the images
+
+    Args:
+        original: The original image
+        coded: The coded image
+        block_size: The size of the blocks
+        chunk_rows: The number of rows of each chunk
+    Returns:
+        A (rows, cols) array with the PSNR of each block in dB, inf for identical blocks
+    """
+    errors = block_mse_map(original, coded, block_size, chunk_rows)
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(255**2 / errors)
+
+
+def compression_ratio(original, encoded_size):
+    return round(np.size(original) / encoded_size, 2)
+
+
+def bits_per_pixel(original, encoded_size):
+    return round(8 * encoded_size / np.size(original), 3)
+
+
+def execute_all_metrics(original, coded, encoded_size=None) -> dict:
+    """
+    Calculate all the metrics of a coded 8-bit grayscale image
 
-def execute_all_metrics(original, coded) -> dict:
-    return {
+    Args:
+        original: The original image
+        coded: The coded image
+        encoded_size: The size in bytes of the encoded image, the compression
+            ratio and bits per pixel are only calculated if given
+    Returns:
+        A dictionary with the value of each metric, the block PSNR map is an array
+    """
+    metrics = {
         "PSNR (dB)": psnr(original, coded),
-    }
\ No newline at end of file
+        "SSIM": ssim(original, coded),
+        "MS-SSIM": ms_ssim(original, coded),
+        "Block PSNR (dB)": block_psnr_map(original, coded),
+    }
+    if encoded_size:
+        metrics["Compression ratio"] = compression_ratio(original, encoded_size)
+        metrics["Bits per pixel"] = bits_per_pixel(original, encoded_size)
+    return metrics
@@ -0,0 +1,99 @@
+import functools
+import json
+import time
+import tracemalloc
+
+
+class StageStats:
+    def __init__(self, trace_memory=False):
+        """
+        Time and memory of each stage of a call of a codification. It is a
+        stage listener: the time between a stage notification and the
+        previous one (or the start of the call) is added to the stage, so a
+        stage that runs several times, like the chunks of the entropy
+        coding, adds up all its runs.
+
+        With trace_memory the peak of the memory allocated by Python and
+        numpy during each stage is measured too, using tracemalloc, which
+        slows down the call.
+
+        Args:
+            trace_memory: Measure the memory peak of each stage
+        """
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.total_time = 0.0
+        self.peak_memory = None
+        self._start = None
+        self._last = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.peak_memory = 0
+        self._start = self._last = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total_time = time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def on_stage(self, stage, snapshot=None):
+        now = time.perf_counter()
+        stats = self.stages.setdefault(stage, {"time": 0.0, "calls": 0})
+        stats["time"] += now - self._last
+        stats["calls"] += 1
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            stats["peak_memory"] = max(stats.get("peak_memory", 0), peak)
+            self.peak_memory = max(self.peak_memory, peak)
+            tracemalloc.reset_peak()
+        # The time spent here is not part of any stage
+        self._last = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        stats = {"total_time": self.total_time, "stages": self.stages}
+        if self.trace_memory:
+            stats["peak_memory"] = self.peak_memory
+        return stats
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def __str__(self):
+        lines = [f"{'Stage':<22}{'Time (ms)':>12}{'Calls':>8}" + (f"{'Peak (MB)':>12}" if self.trace_memory else "")]
+        for stage, stats in self.stages.items():
+            line = f"{stage:<22}{stats['time'] * 1000:>12.2f}{stats['calls']:>8}"
+            if self.trace_memory:
+                line += f"{stats['peak_memory'] / 2 ** 20:>12.2f}"
+            lines.append(line)
+        lines.append(f"{'Total':<22}{self.total_time * 1000:>12.2f}")
+        return "\n".join(lines)
+
+
+def profiled(method):
+    """
+    Decorator of the methods of a codification that profiles their calls
+    when the profile attribute is set, keeping the StageStats of the last
+    call in the stats attribute. The codification must notify its stages to
+    the listeners added with add_listener.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.profile:
+            return method(self, *args, **kwargs)
+
+        stats = StageStats(trace_memory=self.profile == "memory")
+        self.add_listener(stats.on_stage)
+        try:
+            with stats:
+                return method(self, *args, **kwargs)
+        finally:
+            self.remove_listener(stats.on_stage)
+            self.stats = stats
+    return wrapper
@@ -0,0 +1,59 @@
+import os
+
+
+class OutputStream:
+    def __init__(self, target):
+        """
+        Binary output of a codification that counts the bytes written. The
+        target can be the path of a file, which is opened and closed by the
+        stream, a writable binary stream, which is left open, or a writable
+        buffer (a bytearray, a writable memoryview, a uint8 numpy array...),
+        which is filled from its start.
+
+        Args:
+            target: The path, stream or buffer to write to
+        """
+        self.target = target
+        self.size = 0
+        self._file = None
+        self._buffer = None
+        if isinstance(target, (str, os.PathLike)):
+            self._file = open(target, 'wb')
+        elif hasattr(target, 'write'):
+            self._file = target
+        else:
+            try:
+                self._buffer = memoryview(target).cast('B')
+            except TypeError:
+                raise ValueError(f"Cannot write to {type(target).__name__}, expected a path, a binary stream or a buffer")
+            if self._buffer.readonly:
+                raise ValueError("The output buffer is read-only")
+
+    def write(self, data):
+        """
+        Write bytes to the target
+
+        Args:
+            data: A bytes-like object
+        Returns:
+            The number of bytes written
+        """
+        data = memoryview(data).cast('B')
+        if self._buffer is not None:
+            if self.size + data.nbytes > self._buffer.nbytes:
+                raise ValueError(f"The output buffer of {self._buffer.nbytes} bytes is too small")
+            self._buffer[self.size:self.size + data.nbytes] = data
+        else:
+            self._file.write(data)
+        self.size += data.nbytes
+        return data.nbytes
+
+    def close(self):
+        if self._file is not None and self._file is not self.target:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
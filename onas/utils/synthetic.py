@@ -0,0 +1,67 @@
+import numpy as np
+
+IMAGE_KINDS = ("noise", "gradient", "text")
+
+# Rows of the synthetic images generated at once
+SYNTHETIC_CHUNK_ROWS = 1024
+
+
+def image_shape(megapixels):
+    """
+    Get the (height, width) of a 4:3 image with the number of megapixels
+    """
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    return int(round(megapixels * 1e6 / width)), width
+
+
+def synthetic_image(kind, megapixels, seed=0):
+    """
+    Generate a deterministic 8-bit grayscale image, row chunk by row chunk so
+    the only full-size array is the image itself
+
+    Args:
+        kind: "noise" (uniform noise), "gradient" (smooth diagonal gradient
+              with a low frequency ripple) or "text" (dark glyph-like strokes
+              on a light background, with sharp edges)
+        megapixels: The size of the image
+        seed: The seed of the random generator
+    Returns:
+        The image
+    """
+    height, width = image_shape(megapixels)
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width), dtype=np.uint8)
+
+    if kind == "text":
+        # A set of glyphs made of horizontal and vertical strokes in 12x20 cells
+        glyph_height, glyph_width = 20, 12
+        glyphs = np.full((64, glyph_height, glyph_width), 235, dtype=np.uint8)
+        for glyph in glyphs:
+            for _ in range(rng.integers(2, 5)):
+                if rng.integers(2):
+                    row = rng.integers(3, glyph_height - 5)
+                    glyph[row:row + 2, 2:glyph_width - 2] = 20
+                else:
+                    column = rng.integers(2, glyph_width - 4)
+                    glyph[3:glyph_height - 3, column:column + 2] = 20
+        cell_rows, cell_cols = -(-height // glyph_height), -(-width // glyph_width)
+        text = rng.integers(len(glyphs), size=(cell_rows, cell_cols))
+        # Blank cells for the spaces between words and the line spacing
+        text[rng.random((cell_rows, cell_cols)) < 0.15] = 0
+        glyphs[0] = 235
+        text[1::3] = 0
+
+    for top in range(0, height, SYNTHETIC_CHUNK_ROWS):
+        rows = np.arange(top, min(top + SYNTHETIC_CHUNK_ROWS, height))
+        if kind == "noise":
+            image[rows] = rng.integers(0, 256, size=(len(rows), width), dtype=np.uint8)
+        elif kind == "gradient":
+            y, x = rows[:, None] / height, np.arange(width)[None, :] / width
+            values = 200 * (x + y) / 2 + 25 * np.sin(6 * np.pi * x) * np.cos(4 * np.pi * y) + 30
+            image[rows] = np.clip(values, 0, 255)
+        elif kind == "text":
+            cells = glyphs[text[rows // glyph_height], (rows % glyph_height)[:, None]]
+            image[rows] = cells.reshape(len(rows), -1)[:, :width]
+        else:
+            raise ValueError(f"Unknown image kind: {kind}")
+    return image
@@ -0,0 +1,11 @@
+import pytest
+
+from onas.codecs.validation import ACCURACY_IMPLEMENTATIONS, accuracy_failures, transform_accuracy
+
+
+@pytest.mark.parametrize("implementation", ACCURACY_IMPLEMENTATIONS)
+@pytest.mark.parametrize("kind", ["noise", "gradient", "text"])
+@pytest.mark.parametrize("block_size", [8, 16, 64])
+def test_dct_implementations_match_scipy(implementation, kind, block_size):
+    result = transform_accuracy(kind, 0.25, block_size, implementation)
+    assert accuracy_failures(result) == []
@@ -0,0 +1,20 @@
+import pytest
+
+from onas import JPEG
+
+
+@pytest.mark.parametrize("option, message", [
+    ("Transform", "Unknown transform"),
+    ("Precision", "Unknown precision"),
+    ("Padding", "Unknown padding"),
+    ("DCT Implementation", "Unknown DCT implementation"),
+])
+def test_unknown_options_are_rejected(option, message):
+    with pytest.raises(ValueError, match=message):
+        JPEG().configure(**{option: "Bogus"})
+
+
+@pytest.mark.parametrize("option", ["Transform", "Precision", "Padding", "DCT Implementation"])
+def test_listed_options_are_accepted(option):
+    for value in JPEG().options()[option]["values"]:
+        JPEG().configure(**{option: value})
@@ -0,0 +1,7 @@
+from onas.codecs.validation import IMPORT_BUDGET, import_check
+
+
+def test_import_is_fast_and_lazy():
+    import_time, lazy_modules = import_check()
+    assert lazy_modules == []
+    assert import_time * 1000 <= IMPORT_BUDGET
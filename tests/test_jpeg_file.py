@@ -0,0 +1,87 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from onas import JPEG
+from onas.utils import synthetic_image
+
+LENA = Path(__file__).resolve().parent.parent / "samples" / "lena.png"
+
+
+def lena():
+    return np.asarray(Image.open(LENA).convert("L"))
+
+
+def odd_image(height, width):
+    return np.random.default_rng(height * width).integers(0, 256, (height, width), dtype=np.uint8)
+
+
+def encode(image, **configuration):
+    jpeg = JPEG()
+    jpeg.configure(**configuration)
+    f = io.BytesIO()
+    jpeg(image, f)
+    return f.getvalue()
+
+
+def pil_decode(data):
+    decoded = Image.open(io.BytesIO(data))
+    assert decoded.mode == "L"
+    return np.asarray(decoded)
+
+
+def pil_encode(image, **options):
+    f = io.BytesIO()
+    Image.fromarray(image).save(f, "JPEG", **options)
+    return f.getvalue()
+
+
+def assert_close(decoded, expected):
+    assert decoded.shape == expected.shape
+    assert np.abs(decoded.astype(int) - expected).max() <= 1
+
+
+@pytest.mark.parametrize("configuration", [{}, {"Optimize Huffman": True}, {"restart_rows": 1}, {"restart_rows": 3, "Optimize Huffman": True}])
+@pytest.mark.parametrize("image", [lena(), odd_image(1, 1), odd_image(7, 9), odd_image(17, 33), odd_image(100, 1)], ids=["lena", "1x1", "7x9", "17x33", "100x1"])
+def test_encoded_files_decode_like_pil(image, configuration):
+    data = encode(image, **configuration)
+    expected = pil_decode(data)
+    assert expected.shape == image.shape
+    assert_close(JPEG().decode(data), expected)
+
+
+def test_restart_markers_are_written():
+    image = synthetic_image("text", 0.25)
+    assert b"\xff\xdd" not in encode(image)
+    data = encode(image, restart_rows=2)
+    assert b"\xff\xdd" in data
+    assert all(bytes([0xff, 0xd0 + i]) in data for i in range(8))
+
+
+@pytest.mark.parametrize("options", [{"restart_marker_blocks": 7}, {"restart_marker_rows": 2}, {"optimize": True}])
+def test_decode_pil_files(options):
+    data = pil_encode(lena(), quality=80, **options)
+    assert_close(JPEG().decode(data), pil_decode(data))
+
+
+def test_decode_rejects_progressive_files():
+    with pytest.raises(ValueError, match="baseline"):
+        JPEG().decode(pil_encode(lena(), progressive=True))
+
+
+def test_decode_rejects_color_files():
+    image = np.stack([lena()] * 3, axis=-1)
+    with pytest.raises(ValueError, match="grayscale"):
+        JPEG().decode(pil_encode(image))
+
+
+@pytest.mark.parametrize("configuration", [{}, {"restart_rows": 1}])
+def test_decode_rejects_truncated_files(configuration):
+    data = encode(lena()[:64, :72], **configuration)
+    # Without the EOI marker the file can still be decoded
+    for length in range(len(data) - 2):
+        with pytest.raises(ValueError):
+            JPEG().decode(data[:length])
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from onas.utils import execute_all_metrics, ms_ssim, ssim
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (5, 5), (6, 40), (40, 6), (13, 13)])
+def test_ssim_of_images_smaller_than_the_window(shape):
+    rng = np.random.default_rng(0)
+    original = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    coded = np.clip(original + rng.integers(-5, 6, size=shape), 0, 255).astype(np.uint8)
+
+    assert ssim(original, original) == 1.0
+    assert ms_ssim(original, original) == 1.0
+    assert 0 < ssim(original, coded) < 1
+    assert 0 < ms_ssim(original, coded) < 1
+
+    metrics = execute_all_metrics(original, coded, encoded_size=100)
+    assert np.isfinite(metrics["SSIM"]) and np.isfinite(metrics["MS-SSIM"])
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from onas import JPEG
+from onas.codecs.validation import PRECISION_MEGAPIXELS, precision_accuracy, precision_failures
+from onas.utils import synthetic_image
+
+
+@pytest.mark.parametrize("kind", ["noise", "gradient", "text"])
+@pytest.mark.parametrize("block_size", [8, 16])
+def test_single_precision_keeps_psnr_and_halves_memory(kind, block_size):
+    result = precision_accuracy(kind, PRECISION_MEGAPIXELS, block_size)
+    assert precision_failures(result) == []
+
+
+def test_single_precision_quantizes_to_int16():
+    image = synthetic_image("gradient", 0.25)
+    jpeg = JPEG()
+    jpeg.configure(**{"Precision": "Single", "Quantization Factor": 10})
+    quantized = jpeg._quantize_image(image)
+    assert quantized.dtype == np.int16
+
+    # Only coefficients at a rounding boundary of the quantization can differ, by one step
+    jpeg.configure(**{"Precision": "Double", "Quantization Factor": 10})
+    difference = np.abs(quantized - jpeg._quantize_image(image))
+    assert difference.max() <= 1
+    assert np.count_nonzero(difference) < 1e-3 * difference.size
@@ -0,0 +1,31 @@
+import io
+
+import numpy as np
+import pytest
+
+from onas import JPEG
+from onas.utils import psnr, synthetic_image
+
+
+@pytest.mark.parametrize("kind", ["noise", "gradient", "text"])
+def test_sampled_curve_matches_the_full_one(kind):
+    image = synthetic_image(kind, 1)
+    jpeg = JPEG()
+    full = jpeg.rd_sweep(image, factors=range(1, 101, 9), sample_blocks=10 ** 9)
+    sampled = jpeg.rd_sweep(image, factors=range(1, 101, 9), sample_blocks=2 ** 13)
+    assert np.abs(sampled["psnr"] - full["psnr"]).max() < 0.2
+    assert np.abs(sampled["bpp"] / full["bpp"] - 1).max() < 0.03
+
+
+def test_curve_follows_the_encoder():
+    image = synthetic_image("text", 0.25)
+    jpeg = JPEG()
+    curve = jpeg.rd_sweep(image, factors=[1, 10, 50])
+    assert np.all(np.diff(curve["bpp"]) < 0) and np.all(np.diff(curve["psnr"]) < 0)
+    for factor, curve_psnr, bpp in zip(curve["factors"], curve["psnr"], curve["bpp"]):
+        jpeg.configure(**{"Quantization Factor": factor, "Optimize Huffman": True})
+        # The PSNR of the coefficients misses the clipping of the pixels, up to a dB on text
+        assert abs(psnr(image, jpeg(image)) - curve_psnr) < 1.5
+        # The entropy is a lower bound of the Huffman code, which is close to it
+        size = jpeg(image, io.BytesIO())
+        assert bpp <= 8 * size / image.size < 1.15 * bpp
@@ -0,0 +1,93 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from onas import JPEG
+from onas.utils import synthetic_image
+
+# Not a multiple of the block size, so the last strip and the last blocks are padded
+SHAPE = (203, 117)
+
+
+@pytest.fixture(scope="module")
+def image():
+    return synthetic_image("text", 0.25)[:SHAPE[0], :SHAPE[1]].copy()
+
+
+@pytest.fixture(params=[{}, {"Optimize Huffman": True}, {"restart_rows": 2}])
+def jpeg(request):
+    jpeg = JPEG()
+    jpeg.configure(**request.param)
+    return jpeg
+
+
+def compressed(jpeg, image):
+    f = io.BytesIO()
+    jpeg(image, f)
+    return f.getvalue()
+
+
+def sources(image, directory):
+    np.save(directory / "image.npy", image)
+    image.tofile(directory / "image.raw")
+    Image.fromarray(image).save(directory / "image.bmp")
+    return {
+        "ndarray": (image, None),
+        "npy": (directory / "image.npy", None),
+        "raw": (directory / "image.raw", SHAPE),
+        "raw buffer": (image.tobytes(), SHAPE),
+        "bmp": (directory / "image.bmp", None),
+    }
+
+
+@pytest.mark.parametrize("strip_rows", [1, 3, 64])
+@pytest.mark.parametrize("kind", ["ndarray", "npy", "raw", "raw buffer", "bmp"])
+def test_encode_stream_matches_call(jpeg, image, tmp_path, kind, strip_rows):
+    source, shape = sources(image, tmp_path)[kind]
+    f = io.BytesIO()
+    size = jpeg.encode_stream(source, f, strip_rows=strip_rows, shape=shape)
+    assert f.getvalue() == compressed(jpeg, image)
+    assert size == len(f.getvalue())
+
+
+@pytest.mark.parametrize("output", ["path", "file", "bytearray", "memoryview", "ndarray"])
+@pytest.mark.parametrize("method", ["__call__", "encode_stream"])
+def test_outputs_match(jpeg, image, tmp_path, output, method):
+    expected = compressed(jpeg, image)
+    path = tmp_path / "image.jpg"
+    buffers = {
+        "bytearray": bytearray(len(expected) + 10),
+        "memoryview": memoryview(bytearray(len(expected) + 10)),
+        "ndarray": np.zeros(len(expected) + 10, dtype=np.uint8),
+    }
+    if output == "file":
+        with open(path, "wb") as f:
+            size = getattr(jpeg, method)(image, f)
+    else:
+        size = getattr(jpeg, method)(image, path if output == "path" else buffers[output])
+
+    written = path.read_bytes() if output in ("path", "file") else bytes(memoryview(buffers[output])[:size])
+    assert size == len(expected)
+    assert written == expected
+
+
+@pytest.mark.parametrize("method", ["__call__", "encode_stream"])
+def test_output_buffer_too_small(jpeg, image, method):
+    buffer = bytearray(len(compressed(jpeg, image)) - 1)
+    with pytest.raises(ValueError, match="too small"):
+        getattr(jpeg, method)(image, buffer)
+
+
+def test_read_only_output_buffer(jpeg, image):
+    with pytest.raises(ValueError, match="read-only"):
+        jpeg.encode_stream(image, bytes(100000))
+
+
+def test_encode_stream_matches_call_with_workers(image):
+    jpeg = JPEG()
+    jpeg.configure(workers=2)
+    f = io.BytesIO()
+    jpeg.encode_stream(image, f, strip_rows=5)
+    assert f.getvalue() == compressed(jpeg, image)
@@ -0,0 +1,41 @@
+import io
+
+import pytest
+
+from onas import JPEG
+from onas.utils import psnr, synthetic_image
+
+
+def reconstructed_psnr(image, factor):
+    jpeg = JPEG()
+    jpeg.configure(**{"Quantization Factor": factor})
+    return psnr(image, jpeg(image))
+
+
+@pytest.mark.parametrize("kind, target", [("gradient", 48.7), ("gradient", 40), ("text", 27.9), ("text", 22), ("noise", 13)])
+def test_target_psnr_picks_the_biggest_factor_that_reaches_it(kind, target):
+    image = synthetic_image(kind, 0.25)
+    jpeg = JPEG()
+    jpeg.configure(target_psnr=target)
+    assert psnr(image, jpeg(image)) >= target
+    assert jpeg.quantization_factor == 100 or reconstructed_psnr(image, jpeg.quantization_factor + 1) < target
+
+
+def test_target_psnr_out_of_reach():
+    image = synthetic_image("gradient", 0.25)
+    jpeg = JPEG()
+    jpeg.configure(target_psnr=48.9)
+    with pytest.raises(ValueError, match="Cannot compress"):
+        jpeg(image)
+
+
+@pytest.mark.parametrize("configuration", [{}, {"restart_rows": 4}, {"Optimize Huffman": True}])
+def test_target_bytes_transforms_the_image_once(configuration):
+    image = synthetic_image("text", 0.25)
+    jpeg = JPEG()
+    jpeg.configure(**configuration, target_bytes=20000)
+    stages = []
+    jpeg.add_listener(lambda stage, snapshot: stages.append(stage))
+    size = jpeg(image, io.BytesIO())
+    assert size <= 20000
+    assert stages.count("transform") == 1